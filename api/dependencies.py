@@ -0,0 +1,8 @@
+from fastapi import Request
+
+from core.network_manager import NetworkManager
+
+
+def get_network_manager(request: Request) -> NetworkManager:
+    """دریافت instance مشترک NetworkManager که در زمان راه‌اندازی برنامه ساخته شده است"""
+    return request.app.state.network_manager
@@ -1,33 +1,31 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import List
+import asyncio
 import subprocess
 import re
-import sys
-import os
-
-# Add the parent directory to the path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models.network_models import HostnameConfig
 from core.network_manager import NetworkManager
-
-# ایجاد instance از NetworkManager
-network_manager = NetworkManager()
+from api.dependencies import get_network_manager
+from api.responses import etag_response
 
 # ایجاد router
 router = APIRouter()
 
+# الگوی مجاز hostname (یک بار در زمان import کامپایل می‌شود)
+_HOSTNAME_RE = re.compile(r'^[a-z0-9]([a-z0-9\-]{0,61}[a-z0-9])?$')
+
 @router.get("/hostname", tags=["Hostname Management"])
-async def get_hostname():
+async def get_hostname(request: Request, network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت hostname فعلی سیستم"""
-    hostname = network_manager.get_hostname()
-    return {
+    hostname = await asyncio.to_thread(network_manager.get_hostname)
+    return etag_response(request, {
         "hostname": hostname,
         "message": f"Hostname فعلی: {hostname}"
-    }
+    })
 
 @router.post("/hostname", tags=["Hostname Management"])
-async def set_hostname(config: HostnameConfig):
+async def set_hostname(config: HostnameConfig, network_manager: NetworkManager = Depends(get_network_manager)):
     """تنظیم hostname جدید برای سیستم"""
     # اعتبارسنجی hostname
     if not config.hostname or len(config.hostname.strip()) == 0:
@@ -35,13 +33,13 @@ async def set_hostname(config: HostnameConfig):
     
     # بررسی قوانین hostname
     hostname = config.hostname.strip().lower()
-    if not re.match(r'^[a-z0-9]([a-z0-9\-]{0,61}[a-z0-9])?$', hostname):
+    if not _HOSTNAME_RE.match(hostname):
         raise HTTPException(
             status_code=400, 
             detail="Hostname باید شامل حروف، اعداد و خط تیره باشد و بیشتر از 63 کاراکتر نباشد"
         )
     
-    current_hostname = network_manager.get_hostname()
+    current_hostname = await asyncio.to_thread(network_manager.get_hostname)
     
     if current_hostname == hostname:
         return {
@@ -50,7 +48,7 @@ async def set_hostname(config: HostnameConfig):
             "changed": False
         }
     
-    success = network_manager.set_hostname(hostname)
+    success = await asyncio.to_thread(network_manager.set_hostname, hostname)
     
     if success:
         return {
@@ -64,26 +62,29 @@ async def set_hostname(config: HostnameConfig):
         raise HTTPException(status_code=500, detail="خطا در تنظیم hostname")
 
 @router.get("/system/info", tags=["System Info"])
-async def get_system_info():
+async def get_system_info(request: Request, network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت اطلاعات کامل سیستم شامل hostname و تنظیمات شبکه"""
     try:
-        hostname = network_manager.get_hostname()
-        interfaces = network_manager.get_interfaces()
-        active_interfaces = [iface for iface in interfaces if iface.is_active]
-        dns_servers = network_manager._get_dns_servers()
+        # اجرای همزمان خواندن‌ها؛ زمان پاسخ برابر با کندترین آن‌ها می‌شود
+        hostname, interfaces, dns_servers = await asyncio.gather(
+            asyncio.to_thread(network_manager.get_hostname),
+            asyncio.to_thread(network_manager.get_interfaces),
+            asyncio.to_thread(network_manager._get_dns_servers),
+        )
+        active_count = sum(1 for iface in interfaces if iface.is_active)
         
-        return {
+        return etag_response(request, {
             "hostname": hostname,
             "network_config_type": network_manager.config_type,
             "total_interfaces": len(interfaces),
-            "active_interfaces": len(active_interfaces),
+            "active_interfaces": active_count,
             "dns_servers": dns_servers,
             "system_summary": {
                 "hostname": hostname,
                 "network_method": network_manager.config_type,
-                "active_connections": len(active_interfaces),
+                "active_connections": active_count,
                 "primary_dns": dns_servers[0] if dns_servers else "None"
             }
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"خطا در دریافت اطلاعات سیستم: {str(e)}")
@@ -1,57 +1,44 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from typing import List
+import asyncio
 import subprocess
-import json
 from pathlib import Path
 import yaml
-import sys
-import os
-
-# Add the parent directory to the path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyroute2.netlink.exceptions import NetlinkError
 
 from models.network_models import NetworkInterface, NetworkConfig
 from core.network_manager import NetworkManager
-
-# ایجاد instance از NetworkManager
-network_manager = NetworkManager()
+from api.dependencies import get_network_manager
+from core.command_runner import run_command, APPLY_TIMEOUT
 
 # ایجاد router
 router = APIRouter()
 
-@router.get("/network/interfaces", response_model=List[NetworkInterface], tags=["Network Interfaces"])
-async def get_interfaces():
+@router.get("/network/interfaces", responses={200: {"model": List[NetworkInterface]}}, tags=["Network Interfaces"])
+async def get_interfaces(network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت لیست اینترفیس‌های شبکه عمومی"""
-    return network_manager.get_interfaces()
+    # اجرا در thread تا درخواست‌های همزمان روی یک بار اجرای get_interfaces (single-flight) منتظر بمانند
+    interfaces = await asyncio.to_thread(network_manager.get_interfaces)
+    # serialize مستقیم با pydantic و orjson، بدون عبور از jsonable_encoder
+    return ORJSONResponse([iface.model_dump(mode="json") for iface in interfaces])
 
 @router.get("/network/interfaces/all", tags=["Network Interfaces"])
-async def get_all_interfaces():
+async def get_all_interfaces(network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت لیست تمام اینترفیس‌های شبکه (شامل اینترفیس‌های سیستمی)"""
     try:
-        # دریافت اینترفیس‌ها بدون فیلتر
-        result = subprocess.run(['ip', '-j', 'addr', 'show'], 
-                              capture_output=True, text=True, check=True)
-        ip_data = json.loads(result.stdout)
+        # دریافت اینترفیس‌ها و آدرس‌ها بدون فیلتر از اتصال netlink مشترک
+        links = await asyncio.to_thread(network_manager.get_all_links)
         
         public_interfaces = []
         system_interfaces = []
         
-        for iface_data in ip_data:
-            interface_name = iface_data['ifname']
-            
+        for link in links:
             interface_info = {
-                "name": interface_name,
-                "is_active": 'UP' in iface_data.get('flags', []),
-                "ip_address": None,
-                "type": "public" if network_manager._is_public_network_interface(interface_name) else "system"
+                **link,
+                "type": "public" if network_manager._is_public_network_interface(link["name"]) else "system"
             }
             
-            # استخراج IP address
-            for addr_info in iface_data.get('addr_info', []):
-                if addr_info.get('family') == 'inet':
-                    interface_info["ip_address"] = addr_info.get('local')
-                    break
-            
             if interface_info["type"] == "public":
                 public_interfaces.append(interface_info)
             else:
@@ -59,7 +46,7 @@ async def get_all_interfaces():
         
         return {
             "summary": {
-                "total_interfaces": len(ip_data),
+                "total_interfaces": len(links),
                 "public_interfaces": len(public_interfaces),
                 "system_interfaces": len(system_interfaces)
             },
@@ -71,8 +58,8 @@ async def get_all_interfaces():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"خطا در دریافت اینترفیس‌ها: {str(e)}")
 
-@router.get("/network/interfaces/{interface_name}", response_model=NetworkInterface, tags=["Network Interfaces"])
-async def get_interface(interface_name: str):
+@router.get("/network/interfaces/{interface_name}", responses={200: {"model": NetworkInterface}}, tags=["Network Interfaces"])
+async def get_interface(interface_name: str, network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت اطلاعات یک اینترفیس خاص"""
     # بررسی اینکه اینترفیس یک کارت شبکه عمومی است
     if not network_manager._is_public_network_interface(interface_name):
@@ -81,14 +68,14 @@ async def get_interface(interface_name: str):
             detail=f"اینترفیس {interface_name} یک کارت شبکه عمومی نیست"
         )
     
-    interfaces = network_manager.get_interfaces()
-    for interface in interfaces:
-        if interface.name == interface_name:
-            return interface
-    raise HTTPException(status_code=404, detail=f"اینترفیس {interface_name} یافت نشد")
+    interfaces = await asyncio.to_thread(network_manager.get_interfaces_by_name)
+    interface = interfaces.get(interface_name)
+    if interface is None:
+        raise HTTPException(status_code=404, detail=f"اینترفیس {interface_name} یافت نشد")
+    return ORJSONResponse(interface.model_dump(mode="json"))
 
 @router.post("/network/interfaces/{interface_name}/configure", tags=["Interface Configuration"])
-async def configure_interface(interface_name: str, config: NetworkConfig):
+async def configure_interface(interface_name: str, config: NetworkConfig, network_manager: NetworkManager = Depends(get_network_manager)):
     """پیکربندی یک اینترفیس شبکه"""
     # بررسی اینکه اینترفیس یک کارت شبکه عمومی است
     if not network_manager._is_public_network_interface(interface_name):
@@ -98,25 +85,23 @@ async def configure_interface(interface_name: str, config: NetworkConfig):
         )
     
     # بررسی وجود اینترفیس
-    interfaces = network_manager.get_interfaces()
-    interface_exists = any(iface.name == interface_name for iface in interfaces)
-    
-    if not interface_exists:
+    if not await asyncio.to_thread(network_manager.interface_exists, interface_name):
         raise HTTPException(status_code=404, detail=f"اینترفیس {interface_name} یافت نشد")
     
-    success = network_manager.configure_interface(interface_name, config)
+    success = await asyncio.to_thread(network_manager.configure_interface, interface_name, config)
     
     if success:
         return {
             "message": f"اینترفیس {interface_name} با موفقیت پیکربندی شد",
             "interface": interface_name,
-            "config": config.dict()
+            "config": config.model_dump(),
+            "queued": network_manager.netplan_apply_pending
         }
     else:
         raise HTTPException(status_code=500, detail="خطا در پیکربندی اینترفیس")
 
 @router.post("/network/interfaces/{interface_name}/restart", tags=["Interface Configuration"])
-async def restart_interface(interface_name: str):
+async def restart_interface(interface_name: str, network_manager: NetworkManager = Depends(get_network_manager)):
     """راه‌اندازی مجدد یک اینترفیس"""
     # بررسی اینکه اینترفیس یک کارت شبکه عمومی است
     if not network_manager._is_public_network_interface(interface_name):
@@ -125,68 +110,73 @@ async def restart_interface(interface_name: str):
             detail=f"اینترفیس {interface_name} یک کارت شبکه عمومی نیست و قابل مدیریت نمی‌باشد"
         )
     
+    # بررسی وجود اینترفیس (netplan apply برای هر نامی موفق برمی‌گردد)
+    if not await asyncio.to_thread(network_manager.interface_exists, interface_name):
+        raise HTTPException(status_code=404, detail=f"اینترفیس {interface_name} یافت نشد")
+    
+    # درخواست‌های همزمان restart برای یک اینترفیس در یک اجرا ادغام می‌شوند
+    return await network_manager.coalescer.run(
+        ("restart", interface_name),
+        lambda: _restart_interface(network_manager, interface_name)
+    )
+
+async def _restart_interface(network_manager: NetworkManager, interface_name: str) -> dict:
+    """اجرای راه‌اندازی مجدد اینترفیس بر اساس نوع تنظیمات شبکه"""
     try:
         # تشخیص نوع تنظیمات شبکه و استفاده از روش مناسب
         if network_manager.config_type == "netplan":
-            # برای netplan از ip command و netplan apply استفاده کن
             try:
-                # پایین آوردن اینترفیس
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "down"], check=True)
-                
-                # اعمال مجدد تنظیمات netplan (فقط در host system)
                 if not network_manager.is_container:
-                    subprocess.run(["netplan", "apply"], check=True)
+                    # netplan apply خودش لینک را دوباره ارزیابی می‌کند، نیازی به down/up جداگانه نیست
+                    await asyncio.to_thread(network_manager.netplan_apply)
                 else:
-                    # در container فقط generate کن
+                    # در container، apply کار نمی‌کند؛ اینترفیس را از طریق netlink پایین و بالا بیاور
+                    await asyncio.to_thread(network_manager.set_link_state, interface_name, "down")
+                    
+                    # در container فقط generate کن (اگر فایل‌ها از آخرین generate تغییر کرده باشند)
                     try:
-                        subprocess.run(["netplan", "generate"], check=False)
-                    except:
+                        await asyncio.to_thread(network_manager.netplan_generate)
+                    except Exception:
                         pass
-                
-                # بالا آوردن اینترفیس
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # fallback: فقط ip command
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "down"], check=False)
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=True)
+                    
+                    await asyncio.to_thread(network_manager.set_link_state, interface_name, "up")
+            except (subprocess.SubprocessError, FileNotFoundError, NetlinkError):
+                # fallback: پایین و بالا آوردن از طریق netlink
+                await asyncio.to_thread(network_manager.restart_link, interface_name)
         
         elif network_manager.config_type == "interfaces":
             # برای interfaces سنتی از ifup/ifdown استفاده کن
             try:
-                subprocess.run(["ifdown", interface_name], check=False)
-                subprocess.run(["ifup", interface_name], check=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # fallback: ip command
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "down"], check=False)
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=True)
+                await run_command([network_manager._tool("ifdown"), interface_name], timeout=APPLY_TIMEOUT, check=False)
+                await run_command([network_manager._tool("ifup"), interface_name], timeout=APPLY_TIMEOUT)
+            except (subprocess.SubprocessError, FileNotFoundError):
+                # fallback: پایین و بالا آوردن از طریق netlink
+                await asyncio.to_thread(network_manager.restart_link, interface_name)
         
         elif network_manager.config_type == "networkmanager":
-            # برای NetworkManager
+            # برای NetworkManager، اعمال مجدد تنظیمات روی همان device بدون down/up
             try:
-                subprocess.run(["nmcli", "connection", "down", interface_name], check=False)
-                subprocess.run(["nmcli", "connection", "up", interface_name], check=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # fallback: ip command
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "down"], check=False)
-                subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=True)
+                await run_command([network_manager._tool("nmcli"), "device", "reapply", interface_name], timeout=APPLY_TIMEOUT)
+            except (subprocess.SubprocessError, FileNotFoundError):
+                # fallback: پایین و بالا آوردن از طریق netlink
+                await asyncio.to_thread(network_manager.restart_link, interface_name)
         
         else:
-            # برای سایر موارد فقط ip command
-            subprocess.run(["ip", "link", "set", "dev", interface_name, "down"], check=False)
-            subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=True)
+            # برای سایر موارد فقط netlink
+            await asyncio.to_thread(network_manager.restart_link, interface_name)
         
         return {
             "message": f"اینترفیس {interface_name} با موفقیت راه‌اندازی مجدد شد",
             "method": network_manager.config_type
         }
-    except subprocess.CalledProcessError as e:
+    except (subprocess.SubprocessError, NetlinkError) as e:
         raise HTTPException(
             status_code=500, 
             detail=f"خطا در راه‌اندازی مجدد اینترفیس: {str(e)}"
         )
 
 @router.post("/network/interfaces/{interface_name}/enable", tags=["Interface Configuration"])
-async def enable_interface(interface_name: str):
+async def enable_interface(interface_name: str, network_manager: NetworkManager = Depends(get_network_manager)):
     """فعال کردن یک اینترفیس"""
     # بررسی اینکه اینترفیس یک کارت شبکه عمومی است
     if not network_manager._is_public_network_interface(interface_name):
@@ -196,27 +186,27 @@ async def enable_interface(interface_name: str):
         )
     
     try:
-        subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=True)
+        await asyncio.to_thread(network_manager.set_link_state, interface_name, "up")
         
         # اگر netplan است، تنظیمات را نیز اعمال کن
         if network_manager.config_type == "netplan":
             try:
-                subprocess.run(["netplan", "apply"], check=False)
-            except (subprocess.CalledProcessError, FileNotFoundError):
+                await asyncio.to_thread(network_manager.netplan_apply)
+            except (subprocess.SubprocessError, FileNotFoundError):
                 pass
         
         return {
             "message": f"اینترفیس {interface_name} فعال شد",
-            "method": "ip command" + (" + netplan apply" if network_manager.config_type == "netplan" else "")
+            "method": "netlink" + (" + netplan apply" if network_manager.config_type == "netplan" else "")
         }
-    except subprocess.CalledProcessError as e:
+    except (subprocess.SubprocessError, NetlinkError) as e:
         raise HTTPException(
             status_code=500,
             detail=f"خطا در فعال کردن اینترفیس: {str(e)}"
         )
 
 @router.post("/network/interfaces/{interface_name}/disable", tags=["Interface Configuration"])
-async def disable_interface(interface_name: str):
+async def disable_interface(interface_name: str, network_manager: NetworkManager = Depends(get_network_manager)):
     """غیرفعال کردن یک اینترفیس"""
     # بررسی اینکه اینترفیس یک کارت شبکه عمومی است
     if not network_manager._is_public_network_interface(interface_name):
@@ -226,12 +216,12 @@ async def disable_interface(interface_name: str):
         )
     
     try:
-        subprocess.run(["ip", "link", "set", "dev", interface_name, "down"], check=True)
+        await asyncio.to_thread(network_manager.set_link_state, interface_name, "down")
         return {
             "message": f"اینترفیس {interface_name} غیرفعال شد",
-            "method": "ip command"
+            "method": "netlink"
         }
-    except subprocess.CalledProcessError as e:
+    except NetlinkError as e:
         raise HTTPException(
             status_code=500,
             detail=f"خطا در غیرفعال کردن اینترفیس: {str(e)}"
@@ -1,72 +1,136 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+import asyncio
 import subprocess
-from pathlib import Path
-import yaml
-import sys
 import os
 
-# Add the parent directory to the path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
 from core.network_manager import NetworkManager
-
-# ایجاد instance از NetworkManager
-network_manager = NetworkManager()
+from api.dependencies import get_network_manager
+from api.responses import etag_response, ndjson_response, not_modified_response, wants_ndjson
+from core.command_runner import run_command, APPLY_TIMEOUT
 
 # ایجاد router
 router = APIRouter()
 
 @router.get("/network/netplan/files", tags=["System Info"])
-async def get_netplan_files():
+async def get_netplan_files(request: Request, network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت لیست فایل‌های netplan موجود"""
     try:
-        netplan_dir = Path("/etc/netplan")
-        files_info = []
+        netplan_dir = "/etc/netplan"
         
-        if netplan_dir.exists():
-            for config_file in netplan_dir.glob("*.yaml"):
-                try:
-                    with open(config_file, "r") as f:
-                        config = yaml.safe_load(f)
-                    
-                    # استخراج اینترفیس‌های تعریف شده
-                    interfaces = []
-                    if config and "network" in config:
-                        ethernets = config["network"].get("ethernets", {})
-                        interfaces = list(ethernets.keys())
-                    
-                    file_info = {
-                        "filename": config_file.name,
-                        "path": str(config_file),
-                        "interfaces": interfaces,
-                        "size": config_file.stat().st_size,
-                        "modified": config_file.stat().st_mtime
-                    }
-                    files_info.append(file_info)
-                
-                except Exception as e:
-                    # اگر خطایی در خواندن فایل رخ داد
-                    file_info = {
-                        "filename": config_file.name,
-                        "path": str(config_file),
-                        "interfaces": [],
-                        "error": str(e),
-                        "size": config_file.stat().st_size,
-                        "modified": config_file.stat().st_mtime
-                    }
-                    files_info.append(file_info)
+        # JSON و NDJSON دو نمایش متفاوت از یک لیست هستند و ETag جداگانه دارند
+        ndjson = wants_ndjson(request)
         
-        return {
-            "netplan_directory": str(netplan_dir),
+        # اگر inotify از آخرین درخواست تغییری گزارش نکرده، نتیجه قبلی بدون هیچ syscall معتبر است
+        generation = network_manager.netplan_generation
+        cached = network_manager.cached_netplan_listing(generation)
+        if cached is not None:
+            etag, files_info = cached
+            not_modified = not_modified_response(request, _listing_etag(etag, ndjson))
+            if not_modified is not None:
+                return _vary_on_accept(not_modified)
+            if ndjson:
+                return _vary_on_accept(ndjson_response(_iter_items(files_info), etag=_listing_etag(etag, ndjson)))
+        else:
+            # خواندن دایرکتوری و stat فایل‌ها در thread جدا تا event loop بلاک نشود
+            entries, etag = await asyncio.to_thread(_scan_netplan_files, network_manager, netplan_dir)
+            
+            # اگر کلاینت نسخه فعلی را دارد، نیازی به خواندن فایل‌ها نیست
+            not_modified = not_modified_response(request, _listing_etag(etag, ndjson))
+            if not_modified is not None:
+                return _vary_on_accept(not_modified)
+            
+            # با Accept: application/x-ndjson هر فایل به محض parse شدن ارسال می‌شود
+            if ndjson:
+                return _vary_on_accept(ndjson_response(
+                    _stream_netplan_files(network_manager, entries, generation, etag),
+                    etag=_listing_etag(etag, ndjson)
+                ))
+            
+            files_info = await asyncio.to_thread(_describe_netplan_files, network_manager, entries)
+            network_manager.store_netplan_listing(generation, etag, files_info)
+        
+        return _vary_on_accept(etag_response(request, {
+            "netplan_directory": netplan_dir,
             "total_files": len(files_info),
             "files": files_info
-        }
+        }, etag=etag))
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"خطا در دریافت فایل‌های netplan: {str(e)}")
 
+def _listing_etag(etag: str, ndjson: bool) -> str:
+    """ETag لیست فایل‌ها برای نمایش درخواست شده (JSON یا NDJSON)"""
+    return f"{etag}-ndjson" if ndjson else etag
+
+def _vary_on_accept(response):
+    """پاسخ به هدر Accept بستگی دارد؛ cache ها نباید نمایش‌ها را با هم اشتباه بگیرند"""
+    response.headers["Vary"] = "Accept"
+    return response
+
+def _scan_netplan_files(network_manager: NetworkManager, netplan_dir: str):
+    """لیست فایل‌های netplan همراه با stat هر فایل و ETag دایرکتوری"""
+    if not os.path.isdir(netplan_dir):
+        return [], "none"
+    
+    entries = [(e, e.stat()) for e in network_manager._list_netplan_files()]
+    
+    # ETag ارزان از روی زمان تغییر دایرکتوری و فایل‌ها، بدون نیاز به parse یا hash محتوا
+    dir_mtime = os.stat(netplan_dir).st_mtime_ns
+    max_mtime = max((st.st_mtime_ns for _, st in entries), default=0)
+    return entries, f"{len(entries)}-{dir_mtime}-{max_mtime}"
+
+def _describe_netplan_files(network_manager: NetworkManager, entries) -> list:
+    """اطلاعات هر فایل netplan شامل اینترفیس‌های تعریف شده در آن"""
+    return [_describe_netplan_file(network_manager, entry, st) for entry, st in entries]
+
+def _describe_netplan_file(network_manager: NetworkManager, entry, st) -> dict:
+    """اطلاعات یک فایل netplan شامل اینترفیس‌های تعریف شده در آن"""
+    try:
+        config = network_manager._load_netplan_config(entry.path, st)
+        
+        # استخراج اینترفیس‌های تعریف شده
+        interfaces = []
+        if config and "network" in config:
+            ethernets = config["network"].get("ethernets", {})
+            interfaces = list(ethernets.keys())
+        
+        return {
+            "filename": entry.name,
+            "path": entry.path,
+            "interfaces": interfaces,
+            "size": st.st_size,
+            "modified": st.st_mtime
+        }
+    
+    except Exception as e:
+        # اگر خطایی در خواندن فایل رخ داد
+        return {
+            "filename": entry.name,
+            "path": entry.path,
+            "interfaces": [],
+            "error": str(e),
+            "size": st.st_size,
+            "modified": st.st_mtime
+        }
+
+async def _stream_netplan_files(network_manager: NetworkManager, entries, generation, etag):
+    """parse فایل‌ها یکی یکی در thread جدا و برگرداندن هر کدام به محض آماده شدن"""
+    files_info = []
+    for entry, st in entries:
+        file_info = await asyncio.to_thread(_describe_netplan_file, network_manager, entry, st)
+        files_info.append(file_info)
+        yield file_info
+    
+    # لیست کامل برای درخواست‌های بعدی هم قابل استفاده است
+    network_manager.store_netplan_listing(generation, etag, files_info)
+
+async def _iter_items(items):
+    """تبدیل یک لیست آماده به async iterator برای ndjson_response"""
+    for item in items:
+        yield item
+
 @router.delete("/network/netplan/cleanup/{interface_name}", tags=["Interface Configuration"])
-async def cleanup_netplan_interface(interface_name: str):
+async def cleanup_netplan_interface(interface_name: str, network_manager: NetworkManager = Depends(get_network_manager)):
     """پاک کردن دستی فایل‌های netplan مربوط به یک اینترفیس"""
     try:
         # بررسی اینکه اینترفیس یک کارت شبکه عمومی است
@@ -77,14 +141,11 @@ async def cleanup_netplan_interface(interface_name: str):
             )
         
         # بررسی وجود اینترفیس
-        interfaces = network_manager.get_interfaces()
-        interface_exists = any(iface.name == interface_name for iface in interfaces)
-        
-        if not interface_exists:
+        if not await asyncio.to_thread(network_manager.interface_exists, interface_name):
             raise HTTPException(status_code=404, detail=f"اینترفیس {interface_name} یافت نشد")
         
         # پاک کردن فایل‌های netplan
-        network_manager._cleanup_netplan_files(interface_name)
+        await asyncio.to_thread(network_manager._cleanup_netplan_files, interface_name)
         
         return {
             "message": f"فایل‌های netplan مربوط به اینترفیس {interface_name} پاک شدند",
@@ -97,87 +158,79 @@ async def cleanup_netplan_interface(interface_name: str):
         raise HTTPException(status_code=500, detail=f"خطا در پاک کردن فایل‌های netplan: {str(e)}")
 
 @router.post("/network/apply-config", tags=["Interface Configuration"])
-async def apply_network_config():
+async def apply_network_config(network_manager: NetworkManager = Depends(get_network_manager)):
     """اعمال تنظیمات شبکه بر اساس نوع سیستم"""
     try:
-        result = {
-            "config_type": network_manager.config_type,
-            "actions_performed": [],
-            "success": True
-        }
-        
-        if network_manager.config_type == "netplan":
-            try:
-                if network_manager.is_container:
-                    # در container فقط generate کن
-                    subprocess.run(["netplan", "generate"], check=True)
+        # درخواست‌هایی که همزمان برسند نتیجه یک اجرای مشترک را می‌گیرند
+        return await network_manager.coalescer.run("apply-config", lambda: _apply_network_config(network_manager))
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"خطا در اعمال تنظیمات شبکه: {str(e)}")
+
+async def _apply_network_config(network_manager: NetworkManager) -> dict:
+    """اجرای دستورات اعمال تنظیمات شبکه"""
+    result = {
+        "config_type": network_manager.config_type,
+        "actions_performed": [],
+        "success": True
+    }
+    
+    if network_manager.config_type == "netplan":
+        try:
+            if network_manager.is_container:
+                # در container فقط generate کن (اگر فایل‌ها از آخرین generate تغییر کرده باشند)
+                if await asyncio.to_thread(network_manager.netplan_generate):
                     result["actions_performed"].append("netplan generate executed (container mode)")
                 else:
-                    # در host system از apply استفاده کن
-                    subprocess.run(["netplan", "apply"], check=True)
-                    result["actions_performed"].append("netplan apply executed")
-            except (subprocess.CalledProcessError, FileNotFoundError) as e:
-                result["actions_performed"].append(f"netplan operation failed: {str(e)}")
-                result["success"] = False
-        
-        elif network_manager.config_type == "interfaces":
-            try:
-                subprocess.run(["systemctl", "restart", "networking"], check=True)
-                result["actions_performed"].append("networking service restarted")
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                try:
-                    subprocess.run(["/etc/init.d/networking", "restart"], check=True)
-                    result["actions_performed"].append("networking init script executed")
-                except (subprocess.CalledProcessError, FileNotFoundError) as e:
-                    result["actions_performed"].append(f"networking restart failed: {str(e)}")
-                    result["success"] = False
-        
-        elif network_manager.config_type == "networkmanager":
+                    result["actions_performed"].append("netplan generate skipped, no changes (container mode)")
+            else:
+                # در host system از apply استفاده کن؛ apply با تاخیر کوتاه در پس‌زمینه اجرا می‌شود
+                if not network_manager.available_tools["netplan"]:
+                    raise FileNotFoundError("netplan")
+                network_manager.schedule_netplan_apply()
+                result["actions_performed"].append("netplan apply queued")
+                result["queued"] = True
+        except (subprocess.SubprocessError, FileNotFoundError) as e:
+            result["actions_performed"].append(f"netplan operation failed: {str(e)}")
+            result["success"] = False
+    
+    elif network_manager.config_type == "interfaces":
+        try:
+            await run_command([network_manager._tool("systemctl"), "restart", "networking"], timeout=APPLY_TIMEOUT)
+            result["actions_performed"].append("networking service restarted")
+        except (subprocess.SubprocessError, FileNotFoundError):
             try:
-                subprocess.run(["systemctl", "restart", "NetworkManager"], check=True)
-                result["actions_performed"].append("NetworkManager restarted")
-            except (subprocess.CalledProcessError, FileNotFoundError) as e:
-                result["actions_performed"].append(f"NetworkManager restart failed: {str(e)}")
+                await run_command(["/etc/init.d/networking", "restart"], timeout=APPLY_TIMEOUT)
+                result["actions_performed"].append("networking init script executed")
+            except (subprocess.SubprocessError, FileNotFoundError) as e:
+                result["actions_performed"].append(f"networking restart failed: {str(e)}")
                 result["success"] = False
-        
-        else:
-            result["actions_performed"].append("No specific action for unknown config type")
+    
+    elif network_manager.config_type == "networkmanager":
+        try:
+            await run_command([network_manager._tool("systemctl"), "restart", "NetworkManager"], timeout=APPLY_TIMEOUT)
+            result["actions_performed"].append("NetworkManager restarted")
+        except (subprocess.SubprocessError, FileNotFoundError) as e:
+            result["actions_performed"].append(f"NetworkManager restart failed: {str(e)}")
             result["success"] = False
-        
-        if result["success"]:
-            result["message"] = "تنظیمات شبکه با موفقیت اعمال شد"
-        else:
-            result["message"] = "برخی از عملیات با شکست مواجه شدند"
-        
-        return result
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"خطا در اعمال تنظیمات شبکه: {str(e)}")
+    else:
+        result["actions_performed"].append("No specific action for unknown config type")
+        result["success"] = False
+    
+    if result["success"]:
+        result["message"] = "تنظیمات شبکه با موفقیت اعمال شد"
+    else:
+        result["message"] = "برخی از عملیات با شکست مواجه شدند"
+    
+    return result
 
 @router.post("/network/netplan/validate", tags=["System Info"])
-async def validate_netplan():
+async def validate_netplan(network_manager: NetworkManager = Depends(get_network_manager)):
     """اعتبارسنجی تمام فایل‌های netplan"""
     try:
-        netplan_dir = Path("/etc/netplan")
-        validation_results = []
-        
-        if netplan_dir.exists():
-            for config_file in netplan_dir.glob("*.yaml"):
-                is_valid = network_manager._validate_netplan_config(str(config_file))
-                
-                result = {
-                    "file": config_file.name,
-                    "path": str(config_file),
-                    "valid": is_valid,
-                    "permissions": oct(config_file.stat().st_mode)[-3:]
-                }
-                
-                # بررسی مجوزها
-                file_mode = config_file.stat().st_mode & 0o777
-                if file_mode != 0o600:
-                    result["permission_warning"] = f"مجوزها باید 600 باشند، اما {oct(file_mode)[-3:]} هستند"
-                
-                validation_results.append(result)
+        # اجرای netplan و خواندن فایل‌ها در thread جدا تا event loop بلاک نشود
+        validation_results = await asyncio.to_thread(_validate_netplan_files, network_manager, "/etc/netplan")
         
         all_valid = all(r["valid"] for r in validation_results)
         
@@ -191,24 +244,49 @@ async def validate_netplan():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"خطا در اعتبارسنجی netplan: {str(e)}")
 
+def _validate_netplan_files(network_manager: NetworkManager, netplan_dir: str) -> list:
+    """اعتبارسنجی و بررسی مجوز تمام فایل‌های netplan"""
+    validation_results = []
+    
+    if os.path.isdir(netplan_dir):
+        entries = network_manager._list_netplan_files()
+        
+        # یک بار اجرای netplan برای همه فایل‌ها
+        validity = network_manager._validate_all_netplan([e.path for e in entries])
+        
+        for entry in entries:
+            st = entry.stat()
+            
+            file_mode = st.st_mode & 0o777
+            result = {
+                "file": entry.name,
+                "path": entry.path,
+                "valid": validity.get(entry.path, False),
+                "permissions": f"{file_mode:03o}"
+            }
+            
+            # بررسی مجوزها
+            if file_mode != 0o600:
+                result["permission_warning"] = f"مجوزها باید 600 باشند، اما {file_mode:03o} هستند"
+            
+            validation_results.append(result)
+    return validation_results
+
 @router.get("/network/status", tags=["Network Status"])
-async def get_network_status():
+async def get_network_status(network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت وضعیت کلی شبکه"""
     try:
-        # دریافت اطلاعات routing table
-        route_result = subprocess.run(['ip', 'route'], capture_output=True, text=True, check=True)
-        
-        # دریافت اطلاعات DNS
-        dns_servers = network_manager._get_dns_servers()
-        
-        # دریافت اینترفیس‌های فعال
-        interfaces = network_manager.get_interfaces()
-        active_interfaces = [iface for iface in interfaces if iface.is_active]
+        # دریافت همزمان DNS و اینترفیس‌ها
+        dns_servers, interfaces = await asyncio.gather(
+            asyncio.to_thread(network_manager._get_dns_servers),
+            asyncio.to_thread(network_manager.get_interfaces),
+        )
+        active_count = sum(1 for iface in interfaces if iface.is_active)
         
         return {
             "config_type": network_manager.config_type,
             "total_interfaces": len(interfaces),
-            "active_interfaces": len(active_interfaces),
+            "active_interfaces": active_count,
             "dns_servers": dns_servers,
             "interfaces": [
                 {
@@ -224,26 +302,21 @@ async def get_network_status():
         raise HTTPException(status_code=500, detail=f"خطا در دریافت وضعیت شبکه: {str(e)}")
 
 @router.get("/network/dns", tags=["Network Status"])
-async def get_dns_servers():
+async def get_dns_servers(request: Request, network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت لیست DNS servers فعلی"""
-    dns_servers = network_manager._get_dns_servers()
-    return {
+    # خواندن resolv.conf (در صورت miss کش) نباید event loop را بلاک کند
+    dns_servers = await asyncio.to_thread(network_manager._get_dns_servers)
+    return etag_response(request, {
         "dns_servers": dns_servers,
         "count": len(dns_servers)
-    }
+    })
 
 @router.get("/network/routes", tags=["Network Status"]) 
-async def get_routes():
+async def get_routes(network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت جدول مسیریابی"""
-    try:
-        result = subprocess.run(['ip', 'route'], capture_output=True, text=True, check=True)
-        routes = []
-        for line in result.stdout.splitlines():
-            if line.strip():
-                routes.append(line.strip())
-        return {
-            "routes": routes,
-            "count": len(routes)
-        }
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"خطا در دریافت جدول مسیریابی: {str(e)}")
+    # جدول مسیریابی مستقیماً از netlink خوانده می‌شود
+    routes = await asyncio.to_thread(network_manager.get_routes)
+    return {
+        "routes": routes,
+        "count": len(routes)
+    }
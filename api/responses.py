@@ -0,0 +1,55 @@
+import hashlib
+from typing import Any, AsyncIterable, Optional
+
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def etag_response(request: Request, payload: Any, etag: Optional[str] = None) -> Response:
+    """پاسخ JSON همراه با ETag؛ اگر If-None-Match کلاینت برابر باشد، 304 بدون body برمی‌گرداند"""
+    body = None
+    if etag is None:
+        # ETag از hash محتوای پاسخ ساخته می‌شود
+        body = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+        etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
+    
+    if body is None:
+        body = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return Response(content=body, media_type="application/json", headers={"ETag": f'"{etag}"'})
+
+
+def not_modified_response(request: Request, etag: str) -> Optional[Response]:
+    """اگر نسخه کلاینت هنوز معتبر است پاسخ 304 برمی‌گرداند، در غیر این صورت None"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    
+    quoted = f'"{etag}"'
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # پشتیبانی از چند مقدار، * و ETag ضعیف (W/)
+        if candidate == "*" or candidate.removeprefix("W/") == quoted:
+            return Response(status_code=304, headers={"ETag": quoted})
+    return None
+
+
+def wants_ndjson(request: Request) -> bool:
+    """آیا کلاینت صراحتاً خروجی خط به خط (NDJSON) درخواست کرده است"""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(items: AsyncIterable[Any], etag: Optional[str] = None) -> StreamingResponse:
+    """ارسال هر آیتم به صورت یک خط JSON به محض آماده شدن"""
+    async def generate():
+        async for item in items:
+            yield orjson.dumps(item, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    
+    headers = {"ETag": f'"{etag}"'} if etag is not None else None
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -1,54 +1,46 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import List
 import subprocess
 import json
-import os
 import re
 from pathlib import Path
 import yaml
-import sys
-
-# Add the parent directory to the path
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models.network_models import NetworkInterface, HostnameConfig, NetworkConfig
 from core.network_manager import NetworkManager
-
-# ایجاد instance از NetworkManager
-network_manager = NetworkManager()
+from api.dependencies import get_network_manager
+from api.responses import etag_response
 
 # ایجاد router
 router = APIRouter()
 
+# توضیح هر نوع تنظیمات شبکه
+_CONFIG_TYPE_DESCRIPTIONS = {
+    "netplan": "Ubuntu/Netplan configuration",
+    "interfaces": "Debian/Ubuntu traditional interfaces",
+    "networkmanager": "NetworkManager configuration",
+    "systemd-networkd": "Systemd-networkd configuration",
+    "unknown": "Unknown configuration type"
+}
+
 @router.get("/", tags=["System Info"])
 async def root():
     return {"message": "Linux Network Configuration API", "version": "1.0.0"}
 
 @router.get("/network/config-type", tags=["System Info"])
-async def get_config_type():
+async def get_config_type(request: Request, network_manager: NetworkManager = Depends(get_network_manager)):
     """دریافت نوع تنظیمات شبکه سیستم"""
-    return {
+    return etag_response(request, {
         "config_type": network_manager.config_type,
-        "description": {
-            "netplan": "Ubuntu/Netplan configuration",
-            "interfaces": "Debian/Ubuntu traditional interfaces",
-            "networkmanager": "NetworkManager configuration",
-            "systemd-networkd": "Systemd-networkd configuration",
-            "unknown": "Unknown configuration type"
-        }.get(network_manager.config_type, "Unknown")
-    }
+        "description": _CONFIG_TYPE_DESCRIPTIONS.get(network_manager.config_type, "Unknown")
+    })
 
 @router.get("/container/status", tags=["System Info"])
-async def get_container_status():
+async def get_container_status(network_manager: NetworkManager = Depends(get_network_manager)):
     """بررسی وضعیت محیط اجرا (container یا host)"""
     return {
         "is_container": network_manager.is_container,
         "environment": "Docker Container" if network_manager.is_container else "Host System",
-        "available_tools": {
-            "hostnamectl": os.path.exists("/usr/bin/hostnamectl") or os.path.exists("/bin/hostnamectl"),
-            "netplan": os.path.exists("/usr/sbin/netplan") or os.path.exists("/sbin/netplan"),
-            "ifupdown": os.path.exists("/sbin/ifup"),
-            "systemctl": os.path.exists("/usr/bin/systemctl") or os.path.exists("/bin/systemctl")
-        },
+        "available_tools": network_manager.available_tools,
         "config_type": network_manager.config_type
     }
@@ -0,0 +1,57 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# بازه انتظار پیش‌فرض برای جمع کردن درخواست‌های همزمان
+COALESCE_DELAY = 0.05
+
+
+class RequestCoalescer:
+    """یکی کردن درخواست‌های همزمان برای یک کلید؛ درخواست‌هایی که قبل از شروع اجرا برسند نتیجه همان اجرا را می‌گیرند"""
+
+    def __init__(self, delay: float = COALESCE_DELAY):
+        self._delay = delay
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._last_run: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, operation: Callable[[], Awaitable[Any]]) -> Any:
+        """اجرای operation برای key، یا پیوستن به اجرای در انتظار همان key"""
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            # اگر همه درخواست‌کننده‌ها رفته باشند، خطا بدون گزارش نماند
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._pending[key] = future
+
+            task = asyncio.create_task(self._execute(key, future, operation, self._last_run.get(key)))
+            self._last_run[key] = task
+            task.add_done_callback(lambda t: self._last_run.pop(key, None) if self._last_run.get(key) is t else None)
+
+        # قطع شدن یک درخواست نباید اجرای مشترک را لغو کند
+        return await asyncio.shield(future)
+
+    async def _execute(self, key: Hashable, future: asyncio.Future,
+                       operation: Callable[[], Awaitable[Any]], previous: asyncio.Task):
+        """اجرای operation بعد از بازه انتظار و بعد از تمام شدن اجرای قبلی همان key"""
+        try:
+            await asyncio.sleep(self._delay)
+            if previous is not None:
+                await asyncio.wait([previous])
+
+            # از این لحظه درخواست‌های جدید منتظر اجرای بعدی می‌مانند
+            self._discard(key, future)
+
+            result = await operation()
+        except asyncio.CancelledError:
+            self._discard(key, future)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._discard(key, future)
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _discard(self, key: Hashable, future: asyncio.Future):
+        """حذف future از لیست انتظار (اگر هنوز همان future باشد)"""
+        if self._pending.get(key) is future:
+            del self._pending[key]
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import signal
+import subprocess
+from typing import List
+
+# timeout پیش‌فرض برای دستورات سنگین (netplan apply، systemctl)
+APPLY_TIMEOUT = 60
+
+
+async def run_command(cmd: List[str], *, timeout: float, check: bool = True) -> subprocess.CompletedProcess:
+    """اجرای یک دستور بدون بلاک کردن event loop (معادل async برای subprocess.run)"""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        # اجرا در session جدا تا در صورت timeout کل درخت پردازه‌ها kill شود
+        start_new_session=True,
+    )
+
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        _kill_process_tree(proc)
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except asyncio.CancelledError:
+        _kill_process_tree(proc)
+        raise
+
+    result = subprocess.CompletedProcess(
+        cmd, proc.returncode,
+        stdout.decode(errors="replace"), stderr.decode(errors="replace")
+    )
+    if check:
+        result.check_returncode()
+    return result
+
+
+def _kill_process_tree(proc: asyncio.subprocess.Process):
+    """kill کردن پردازه و تمام فرزندان آن"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
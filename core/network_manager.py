@@ -1,25 +1,306 @@
 from fastapi import HTTPException
-from typing import List, Optional
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+import copy
+import functools
+import ipaddress
 import subprocess
+import threading
+import time
 import json
 import os
 import re
-import yaml
-from pathlib import Path
+import shutil
 import socket
-import struct
-import sys
+import tempfile
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from pyroute2 import IPRoute
+from pyroute2.netlink.exceptions import NetlinkError
+
+from models.network_models import NetworkInterface, NetworkConfig, _PREFIX_TO_NETMASK, _NETMASK_TO_PREFIX
+from core.coalescer import RequestCoalescer
+
+# inotify برای دنبال کردن تغییرات /etc/netplan (در صورت نبود، از stat استفاده می‌شود)
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+# استفاده از parser و emitter سریع libyaml در صورت وجود
+try:
+    from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
+
+
+@functools.lru_cache(maxsize=64)
+def _load_yaml_file(path: str, mtime_ns: int, size: int):
+    """parse یک فایل YAML؛ با تغییر mtime یا اندازه فایل، کلید کش عوض شده و دوباره خوانده می‌شود"""
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=_YamlLoader)
+
+
+@functools.lru_cache(maxsize=64)
+def _dhcp_pattern(interface_name: str) -> "re.Pattern":
+    """پترن compile شده خط iface ... inet dhcp برای یک اینترفیس"""
+    return re.compile(rf"iface\s+{re.escape(interface_name)}\s+inet\s+dhcp")
+
+
+class TTLCache:
+    """کش ساده با زمان انقضا (TTL) که درخواست‌های همزمان برای یک کلید را یکی می‌کند"""
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        # با هر invalidate افزایش می‌یابد تا نتیجه محاسبه‌ای که قبل از آن شروع شده ذخیره نشود
+        self._generation = 0
+
+    def get_or_compute(self, key: Hashable, seconds: float, compute: Callable[[], Any]) -> Any:
+        """برگرداندن مقدار کش شده یا محاسبه آن (فقط یک بار برای فراخوانی‌های همزمان)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # single-flight: فقط یک thread محاسبه را انجام می‌دهد و بقیه منتظر نتیجه می‌مانند
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.monotonic():
+                    return entry[1]
+                generation = self._generation
+
+            value = compute()
+
+            with self._lock:
+                # اگر در حین محاسبه تغییری رخ داده، نتیجه ممکن است قدیمی باشد و کش نمی‌شود
+                if self._generation == generation:
+                    self._entries[key] = (time.monotonic() + seconds, value)
+            return value
+
+    def invalidate(self, name: Optional[str] = None):
+        """حذف ورودی‌های کش (همه یا فقط ورودی‌های یک متد)"""
+        with self._lock:
+            self._generation += 1
+            if name is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == name]:
+                    del self._entries[key]
+
+
+def ttl_cache(seconds: float):
+    """دکوریتور کش TTL برای متدهای NetworkManager"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args):
+            key = (func.__name__,) + args
+            return self._cache.get_or_compute(key, seconds, lambda: func(self, *args))
+        return wrapper
+    return decorator
+
+
+def serialized(func):
+    """دکوریتور برای متدهایی که فایل‌های تنظیمات را تغییر می‌دهند؛ این متدها پشت سر هم اجرا می‌شوند"""
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._config_lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
 
-# Add the parent directory to the path so we can import models
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# فلگ IFF_UP در ifinfomsg (معادل UP در خروجی ip)
+IFF_UP = 0x1
 
-from models.network_models import NetworkInterface, NetworkConfig
+# نام‌های مقادیر rtmsg به همان شکلی که ip route نمایش می‌دهد
+_RT_TYPE_NAMES = {2: "local", 3: "broadcast", 4: "anycast", 5: "multicast", 6: "blackhole", 7: "unreachable", 8: "prohibit", 9: "throw", 10: "nat"}
+_RT_PROTO_NAMES = {1: "redirect", 2: "kernel", 3: "boot", 4: "static", 16: "dhcp", 186: "bgp", 188: "ospf"}
+_RT_SCOPE_NAMES = {200: "site", 253: "link", 254: "host", 255: "nowhere"}
+RTNH_F_ONLINK = 0x4
+RTNH_F_LINKDOWN = 0x10
+
+# ابزارهای سیستمی معمولاً در sbin هستند که ممکن است در PATH کاربر غیر root نباشد
+_TOOL_SEARCH_PATH = os.pathsep.join([os.environ.get("PATH", os.defpath), "/usr/sbin", "/sbin"])
+
+
+@functools.lru_cache(maxsize=None)
+def _which(name: str) -> Optional[str]:
+    """جستجوی یک ابزار در PATH؛ نتیجه در طول اجرای برنامه ثابت است"""
+    return shutil.which(name, path=_TOOL_SEARCH_PATH)
+
+
+# پترن مجاز برای نام اینترفیس‌های شبکه عمومی (یک بار compile می‌شود)
+_PUBLIC_IFACE_RE = re.compile(r"""^(?:
+    eth\d+             # eth0, eth1, ...
+  | ens\d+             # ens33, ens160, ...
+  | enp\d+s\d+         # enp0s3, enp2s0, ...
+  | eno\d+             # eno1, eno2, ...
+  | enx[0-9a-f]{12}    # enx001122334455 (MAC-based)
+  | em\d+              # em1, em2, ... (old naming)
+  | p\d+p\d+           # p1p1, p2p1, ... (physical port)
+  | wlan\d+            # wlan0, wlan1, ... (wireless)
+  | wlp\d+s\d+         # wlp2s0, wlp3s0, ... (wireless PCI)
+  | wlo\d+             # wlo1, wlo2, ... (wireless on-board)
+  | wwp\d+s\d+         # wwp0s20f0u6 (wireless WAN)
+)\Z""", re.VERBOSE)
+
+
+@functools.lru_cache(maxsize=256)
+def _is_public_interface_name(interface_name: str) -> bool:
+    """نتیجه بررسی نام اینترفیس کش می‌شود (تعداد نام‌ها محدود است)"""
+    return _PUBLIC_IFACE_RE.match(interface_name) is not None
+
+def _check_ip_token(value: str) -> str:
+    """بررسی اینکه مقدار یک آدرس IP بدون فاصله یا خط جدید است"""
+    if any(c.isspace() for c in value):
+        raise ValueError(f"Invalid IP address: {value!r}")
+    ipaddress.ip_address(value)
+    return value
+
+
+# خطای هر خط در خروجی ip -batch به شکل "Command failed -:N" گزارش می‌شود
+_IP_BATCH_FAILED_RE = re.compile(r'^Command failed -:(\d+)', re.MULTILINE)
+
+# کلمات کلیدی که در /etc/network/interfaces یک بلوک جدید را شروع می‌کنند (به جز allow-*)
+_INTERFACES_STANZA_KEYWORDS = ("auto", "iface", "mapping", "source", "source-directory")
+
+# خطوط nameserver در resolv.conf (فقط فاصله و tab، تا پترن از یک خط به خط بعد نرود)
+_NAMESERVER_RE = re.compile(rb'^[ \t]*nameserver[ \t]+(\S+)', re.MULTILINE)
+
+# در container تنظیمات با ip اعمال می‌شوند؛ با این متغیر اجرای netplan generate هم حذف می‌شود
+_SKIP_CONTAINER_GENERATE = bool(os.environ.get("NETPLAN_SKIP_GENERATE"))
+
+# حداکثر تعداد اعتبارسنجی همزمان فایل‌های netplan در حالت جداگانه
+_VALIDATE_WORKERS = 4
+
+# وضعیت نامعلوم فایل‌های netplan؛ با هیچ وضعیت ثبت شده‌ای برابر نیست
+_UNKNOWN_NETPLAN_SIGNATURE = (-1, -1)
+
+# تاخیر قبل از اجرای netplan apply تا تغییرات پشت سر هم با یک apply اعمال شوند
+NETPLAN_APPLY_DELAY = 0.5
 
 
 class NetworkManager:
     def __init__(self):
+        self._cache = TTLCache()
+        self._apply_lock = threading.Lock()
+        self._apply_run_lock = threading.Lock()
+        self._apply_timer: Optional[threading.Timer] = None
+        self._pending_direct: Dict[str, NetworkConfig] = {}
+        # آخرین پیکربندی netplan هر اینترفیس که با موفقیت اعمال شده است
+        self._applied_netplan: Dict[str, dict] = {}
+        self._hostname_cache: Optional[Tuple[int, str]] = None
+        # وضعیت فایل‌های netplan (تعداد، بیشترین mtime) در آخرین generate موفق
+        self._last_generate_signature: Optional[Tuple[int, int]] = None
+        # اتصال netlink به صورت lazy ساخته می‌شود و بین thread ها با lock مشترک است
+        self._ipr: Optional[IPRoute] = None
+        self._netlink_lock = threading.Lock()
+        # read-modify-write فایل‌های تنظیمات (netplan، interfaces، resolv.conf، hosts) در thread های مختلف
+        # (RLock چون configure_interface خودش _cleanup_netplan_files را صدا می‌زند)
+        self._config_lock = threading.RLock()
+        # netplan generate پس‌زمینه در container روی یک thread اجرا می‌شود
+        self._generate_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="netplan-generate")
+        self._generate_queued = False
+        # درخواست‌های همزمان apply و restart در یک اجرا ادغام می‌شوند
+        self.coalescer = RequestCoalescer()
+        # شمارنده تغییرات /etc/netplan؛ None یعنی inotify فعال نیست
+        self._netplan_generation: Optional[int] = None
+        self._netplan_listing: Optional[Tuple[int, str, list]] = None
+        self._start_netplan_watch()
         self.config_type = self.detect_network_config_type()
         self.is_container = self._detect_container_environment()
+        # ابزارهای موجود در طول اجرای برنامه تغییر نمی‌کنند، پس یک بار بررسی می‌شوند
+        self.available_tools = {
+            "hostnamectl": self._find_tool("hostnamectl") is not None,
+            "netplan": self._find_tool("netplan") is not None,
+            "ifupdown": self._find_tool("ifup") is not None,
+            "systemctl": self._find_tool("systemctl") is not None
+        }
+    
+    def _start_netplan_watch(self):
+        """شروع thread پس‌زمینه برای دنبال کردن تغییرات /etc/netplan با inotify"""
+        if INotify is None:
+            return
+        try:
+            inotify = INotify()
+            inotify.add_watch("/etc/netplan", inotify_flags.CREATE | inotify_flags.DELETE | inotify_flags.MODIFY |
+                              inotify_flags.ATTRIB | inotify_flags.MOVED_FROM | inotify_flags.MOVED_TO |
+                              inotify_flags.DELETE_SELF | inotify_flags.MOVE_SELF)
+        except OSError:
+            return
+        self._netplan_generation = 0
+        threading.Thread(target=self._watch_netplan, args=(inotify,), name="netplan-watch", daemon=True).start()
+    
+    def _watch_netplan(self, inotify):
+        """افزایش شمارنده با هر تغییر در /etc/netplan"""
+        try:
+            while True:
+                events = inotify.read()
+                self._netplan_generation += 1
+                # اگر خود دایرکتوری حذف یا جابجا شد، watch دیگر معتبر نیست
+                if any(event.mask & inotify_flags.IGNORED for event in events):
+                    break
+        except OSError:
+            pass
+        finally:
+            # بدون watch، فراخوانی‌کننده‌ها به بررسی stat برمی‌گردند
+            self._netplan_generation = None
+            inotify.close()
+    
+    @property
+    def netplan_generation(self) -> Optional[int]:
+        """شمارنده تغییرات /etc/netplan (None اگر inotify در دسترس نباشد)"""
+        return self._netplan_generation
+    
+    def cached_netplan_listing(self, generation: Optional[int]) -> Optional[Tuple[str, list]]:
+        """لیست فایل‌های netplan ذخیره شده (ETag و اطلاعات فایل‌ها) اگر بعد از آن تغییری نبوده"""
+        cached = self._netplan_listing
+        if generation is None or cached is None or cached[0] != generation:
+            return None
+        return cached[1], cached[2]
+    
+    def store_netplan_listing(self, generation: Optional[int], etag: str, files_info: list):
+        """ذخیره لیست فایل‌های netplan برای شمارنده تغییرات فعلی (بدون inotify ذخیره نمی‌شود)"""
+        if generation is not None:
+            self._netplan_listing = (generation, etag, files_info)
+    
+    def _netlink(self) -> IPRoute:
+        """اتصال netlink مشترک؛ فقط با در دست داشتن _netlink_lock استفاده شود"""
+        if self._ipr is None:
+            self._ipr = IPRoute()
+        return self._ipr
+    
+    def close(self):
+        """آزاد کردن منابع هنگام خاموش شدن برنامه"""
+        with self._apply_lock:
+            timer = self._apply_timer
+            if timer is not None:
+                timer.cancel()
+        
+        # تنظیماتی که نوشته شده‌اند ولی هنوز apply نشده‌اند از دست نروند
+        if timer is not None:
+            self._run_pending_netplan_apply()
+        
+        # generate در حال اجرا تمام شود (نیمه‌کاره رها نشود)، ولی generate در صف لازم نیست
+        self._generate_executor.shutdown(wait=True, cancel_futures=True)
+        
+        with self._netlink_lock:
+            if self._ipr is not None:
+                self._ipr.close()
+                self._ipr = None
+    
+    def _find_tool(self, name: str) -> Optional[str]:
+        """پیدا کردن مسیر کامل یک ابزار سیستمی"""
+        return _which(name)
+    
+    def _tool(self, name: str) -> str:
+        """مسیر کامل ابزار برای اجرا؛ اگر ابزار نصب نیست، همان FileNotFoundError اجرای دستور بدون fork کردن"""
+        path = _which(name)
+        if path is None:
+            raise FileNotFoundError(f"{name}: command not found")
+        return path
     
     def _detect_container_environment(self) -> bool:
         """تشخیص اینکه آیا در محیط container هستیم یا نه"""
@@ -33,38 +314,80 @@ class NetworkManager:
         
         # بررسی cgroup
         try:
-            with open('/proc/1/cgroup', 'r') as f:
-                content = f.read()
-                if 'docker' in content or 'containerd' in content:
+            # نشانه‌های container در ابتدای فایل هستند، پس خواندن بخش کوچکی کافی است
+            with open('/proc/1/cgroup', 'rb') as f:
+                content = f.read(4096)
+                if b'docker' in content or b'containerd' in content:
                     return True
-        except:
+        except OSError:
             pass
         
         return False
     
+    def schedule_netplan_apply(self, interface_name: Optional[str] = None,
+                               config: Optional[NetworkConfig] = None):
+        """زمان‌بندی netplan apply؛ درخواست‌های داخل بازه تاخیر با یک apply اعمال می‌شوند"""
+        with self._apply_lock:
+            if interface_name and config is not None:
+                self._pending_direct[interface_name] = config
+                # تا پایان apply، پیکربندی این اینترفیس اعمال شده حساب نمی‌شود
+                self._applied_netplan.pop(interface_name, None)
+            if self._apply_timer is not None:
+                self._apply_timer.cancel()
+            self._apply_timer = threading.Timer(NETPLAN_APPLY_DELAY, self._run_pending_netplan_apply)
+            self._apply_timer.daemon = True
+            self._apply_timer.start()
+    
+    @property
+    def netplan_apply_pending(self) -> bool:
+        """آیا netplan apply در صف اجرا است"""
+        with self._apply_lock:
+            return self._apply_timer is not None
+    
+    def _run_pending_netplan_apply(self):
+        """اجرای netplan apply زمان‌بندی شده"""
+        # اجرای apply ها پشت سر هم؛ apply جدید منتظر تمام شدن apply قبلی می‌ماند
+        with self._apply_run_lock:
+            with self._apply_lock:
+                self._apply_timer = None
+                pending = self._pending_direct
+                self._pending_direct = {}
+            
+            try:
+                subprocess.run([self._tool("netplan"), "apply"], check=True, timeout=60)
+                print("Applied netplan configuration")
+                for interface_name, config in pending.items():
+                    self._mark_netplan_applied(interface_name, config)
+            except (subprocess.SubprocessError, FileNotFoundError) as e:
+                # اگر netplan کار نکرد، IP اینترفیس‌های تغییر یافته را مستقیماً اعمال کن
+                print(f"Warning: Could not apply netplan configuration: {e}")
+                for interface_name, config in pending.items():
+                    print(f"Applying IP configuration directly for {interface_name}...")
+                    try:
+                        self._apply_ip_directly(interface_name, config)
+                        self._mark_netplan_applied(interface_name, config)
+                    except Exception as e:
+                        print(f"Warning: Could not apply IP configuration for {interface_name}: {e}")
+            finally:
+                self._cache.invalidate()
+    
+    def netplan_apply(self):
+        """اجرای فوری netplan apply؛ با apply های زمان‌بندی شده همزمان اجرا نمی‌شود"""
+        with self._apply_run_lock:
+            try:
+                subprocess.run([self._tool("netplan"), "apply"], capture_output=True, check=True, timeout=60)
+            finally:
+                self._cache.invalidate()
+    
+    def _mark_netplan_applied(self, interface_name: str, config: NetworkConfig):
+        """ثبت پیکربندی اعمال شده (مگر اینکه در این فاصله درخواست جدیدی برای همین اینترفیس آمده باشد)"""
+        with self._apply_lock:
+            if interface_name not in self._pending_direct:
+                self._applied_netplan[interface_name] = self._build_netplan_config(interface_name, config)
+    
     def _is_public_network_interface(self, interface_name: str) -> bool:
         """بررسی اینکه آیا اینترفیس یک کارت شبکه عمومی است"""
-        # پترن‌های مجاز برای نام اینترفیس‌های شبکه عمومی
-        public_patterns = [
-            r'^eth\d+$',        # eth0, eth1, ...
-            r'^ens\d+$',        # ens33, ens160, ...
-            r'^enp\d+s\d+$',    # enp0s3, enp2s0, ...
-            r'^eno\d+$',        # eno1, eno2, ...
-            r'^enx[0-9a-f]{12}$',  # enx001122334455 (MAC-based)
-            r'^em\d+$',         # em1, em2, ... (old naming)
-            r'^p\d+p\d+$',      # p1p1, p2p1, ... (physical port)
-            r'^wlan\d+$',       # wlan0, wlan1, ... (wireless)
-            r'^wlp\d+s\d+$',    # wlp2s0, wlp3s0, ... (wireless PCI)
-            r'^wlo\d+$',        # wlo1, wlo2, ... (wireless on-board)
-            r'^wwp\d+s\d+$',    # wwp0s20f0u6 (wireless WAN)
-        ]
-        
-        # بررسی با هر یک از پترن‌ها
-        for pattern in public_patterns:
-            if re.match(pattern, interface_name):
-                return True
-        
-        return False
+        return _is_public_interface_name(interface_name)
     
     def detect_network_config_type(self) -> str:
         """تشخیص نوع تنظیمات شبکه در سیستم"""
@@ -86,87 +409,175 @@ class NetworkManager:
         
         return "unknown"
     
+    @ttl_cache(seconds=5)
     def get_interfaces(self) -> List[NetworkInterface]:
         """دریافت لیست اینترفیس‌های شبکه"""
         interfaces = []
         
         try:
-            # دریافت اینترفیس‌ها با ip command
-            result = subprocess.run(['ip', '-j', 'addr', 'show'], 
-                                  capture_output=True, text=True, check=True)
-            ip_data = json.loads(result.stdout)
+            # دریافت اینترفیس‌ها، آدرس‌ها و route های پیش‌فرض از netlink، بدون اجرای ip
+            with self._netlink_lock:
+                ipr = self._netlink()
+                links = ipr.get_links()
+                addrs = ipr.get_addr(family=socket.AF_INET)
+                default_routes = ipr.get_default_routes(family=socket.AF_INET)
+        except (NetlinkError, OSError) as e:
+            raise HTTPException(status_code=500, detail=f"خطا در دریافت اینترفیس‌ها: {str(e)}")
+        
+        # اولین آدرس IPv4 و اولین gateway پیش‌فرض هر اینترفیس (بر اساس index)
+        addr_by_index = {}
+        for addr in addrs:
+            addr_by_index.setdefault(addr['index'], addr)
+        gateway_by_index = {}
+        for route in default_routes:
+            gateway = route.get_attr('RTA_GATEWAY')
+            oif = route.get_attr('RTA_OIF')
+            if gateway and oif is not None:
+                gateway_by_index.setdefault(oif, gateway)
+        
+        # resolv.conf برای همه اینترفیس‌ها یکسان است، پس یک بار خوانده می‌شود
+        dns_servers = self._get_dns_servers()
+        
+        for link in links:
+            interface_name = link.get_attr('IFLA_IFNAME')
             
-            for iface_data in ip_data:
-                interface_name = iface_data['ifname']
-                
-                # فیلتر کردن اینترفیس‌ها - فقط کارت‌های شبکه عمومی
-                if not self._is_public_network_interface(interface_name):
-                    continue
-                
-                interface = NetworkInterface(
-                    name=iface_data['ifname'],
-                    is_active='UP' in iface_data.get('flags', [])
-                )
-                
-                # استخراج IP address
-                for addr_info in iface_data.get('addr_info', []):
-                    if addr_info.get('family') == 'inet':
-                        interface.ip_address = addr_info.get('local')
-                        # محاسبه netmask از prefix length
-                        prefix_len = addr_info.get('prefixlen', 24)
-                        interface.netmask = self._prefix_to_netmask(prefix_len)
-                        break
-                
-                # دریافت gateway
-                interface.gateway = self._get_gateway_for_interface(interface.name)
-                
-                # دریافت DNS servers
-                interface.dns_servers = self._get_dns_servers()
-                
-                # بررسی DHCP
-                interface.is_dhcp = self._is_dhcp_enabled(interface.name)
-                
-                interfaces.append(interface)
+            # فیلتر کردن اینترفیس‌ها - فقط کارت‌های شبکه عمومی
+            if not self._is_public_network_interface(interface_name):
+                continue
+            
+            # استخراج IP address
+            ip_address = netmask = None
+            addr = addr_by_index.get(link['index'])
+            if addr is not None:
+                ip_address = addr.get_attr('IFA_LOCAL') or addr.get_attr('IFA_ADDRESS')
+                # محاسبه netmask از prefix length
+                netmask = self._prefix_to_netmask(addr['prefixlen'])
+            
+            # مقادیر از netlink و خود سرور می‌آیند، پس validation دوباره لازم نیست
+            interfaces.append(NetworkInterface.model_construct(
+                name=interface_name,
+                ip_address=ip_address,
+                netmask=netmask,
+                gateway=gateway_by_index.get(link['index']),
+                dns_servers=dns_servers,
+                is_dhcp=self._is_dhcp_enabled(interface_name),
+                is_active=bool(link['flags'] & IFF_UP)
+            ))
         
-        except subprocess.CalledProcessError as e:
+        return interfaces
+    
+    def get_all_links(self) -> List[Dict[str, Any]]:
+        """لیست تمام اینترفیس‌ها (بدون فیلتر) با وضعیت و اولین آدرس IPv4"""
+        try:
+            with self._netlink_lock:
+                ipr = self._netlink()
+                links = ipr.get_links()
+                addrs = ipr.get_addr(family=socket.AF_INET)
+        except (NetlinkError, OSError) as e:
             raise HTTPException(status_code=500, detail=f"خطا در دریافت اینترفیس‌ها: {str(e)}")
         
-        return interfaces
+        # اولین آدرس IPv4 هر اینترفیس بر اساس ifindex
+        ip_by_index = {}
+        for addr in addrs:
+            ip_by_index.setdefault(addr['index'], addr.get_attr('IFA_LOCAL') or addr.get_attr('IFA_ADDRESS'))
+        
+        return [
+            {
+                "name": link.get_attr('IFLA_IFNAME'),
+                "is_active": bool(link['flags'] & IFF_UP),
+                "ip_address": ip_by_index.get(link['index'])
+            }
+            for link in links
+        ]
     
-    def _prefix_to_netmask(self, prefix_len: int) -> str:
-        """تبدیل prefix length به netmask"""
-        mask = (0xffffffff >> (32 - prefix_len)) << (32 - prefix_len)
-        return f"{(mask >> 24) & 255}.{(mask >> 16) & 255}.{(mask >> 8) & 255}.{mask & 255}"
+    def get_routes(self) -> List[str]:
+        """جدول مسیریابی اصلی IPv4 از netlink، با همان قالب خروجی ip route"""
+        try:
+            with self._netlink_lock:
+                ipr = self._netlink()
+                names = {link['index']: link.get_attr('IFLA_IFNAME') for link in ipr.get_links()}
+                routes = ipr.get_routes(family=socket.AF_INET, table=254)
+        except (NetlinkError, OSError) as e:
+            raise HTTPException(status_code=500, detail=f"خطا در دریافت جدول مسیریابی: {str(e)}")
+        
+        return [self._format_route(route, names) for route in routes]
+    
+    def _format_route(self, route, names: Dict[int, str]) -> str:
+        """تبدیل یک rtmsg به یک خط مشابه خروجی ip route"""
+        dst = route.get_attr('RTA_DST')
+        parts = []
+        if route['type'] in _RT_TYPE_NAMES:
+            parts.append(_RT_TYPE_NAMES[route['type']])
+        parts.append(f"{dst}/{route['dst_len']}" if dst and route['dst_len'] != 32 else dst or "default")
+        
+        gateway = route.get_attr('RTA_GATEWAY')
+        if gateway:
+            parts += ["via", gateway]
+        oif = route.get_attr('RTA_OIF')
+        if oif is not None:
+            parts += ["dev", names.get(oif, str(oif))]
+        # مثل ip route، proto boot و scope global نمایش داده نمی‌شوند
+        if route['proto'] != 3:
+            parts += ["proto", _RT_PROTO_NAMES.get(route['proto'], str(route['proto']))]
+        if route['scope'] != 0:
+            parts += ["scope", _RT_SCOPE_NAMES.get(route['scope'], str(route['scope']))]
+        prefsrc = route.get_attr('RTA_PREFSRC')
+        if prefsrc:
+            parts += ["src", prefsrc]
+        priority = route.get_attr('RTA_PRIORITY')
+        if priority is not None:
+            parts += ["metric", str(priority)]
+        if route['flags'] & RTNH_F_ONLINK:
+            parts.append("onlink")
+        if route['flags'] & RTNH_F_LINKDOWN:
+            parts.append("linkdown")
+        return " ".join(parts)
+    
+    def set_link_state(self, interface_name: str, state: str):
+        """تغییر وضعیت اینترفیس (up/down) مستقیماً از طریق netlink"""
+        try:
+            with self._netlink_lock:
+                ipr = self._netlink()
+                indexes = ipr.link_lookup(ifname=interface_name)
+                if not indexes:
+                    raise HTTPException(status_code=404, detail=f"اینترفیس {interface_name} یافت نشد")
+                ipr.link("set", index=indexes[0], state=state)
+        finally:
+            self._cache.invalidate()
     
-    def _get_gateway_for_interface(self, interface_name: str) -> Optional[str]:
-        """دریافت gateway برای یک اینترفیس"""
+    def interface_exists(self, interface_name: str) -> bool:
+        """بررسی وجود اینترفیس با یک پیام netlink (بدون خواندن لیست کامل اینترفیس‌ها)"""
         try:
-            result = subprocess.run(['ip', 'route', 'show', 'dev', interface_name], 
-                                  capture_output=True, text=True, check=True)
-            for line in result.stdout.splitlines():
-                if 'default' in line:
-                    parts = line.split()
-                    if 'via' in parts:
-                        via_index = parts.index('via')
-                        if via_index + 1 < len(parts):
-                            return parts[via_index + 1]
-        except subprocess.CalledProcessError:
+            with self._netlink_lock:
+                return bool(self._netlink().link_lookup(ifname=interface_name))
+        except (NetlinkError, OSError) as e:
+            raise HTTPException(status_code=500, detail=f"خطا در بررسی اینترفیس: {str(e)}")
+    
+    def restart_link(self, interface_name: str):
+        """پایین و بالا آوردن اینترفیس از طریق netlink"""
+        try:
+            self.set_link_state(interface_name, "down")
+        except NetlinkError:
             pass
-        return None
+        self.set_link_state(interface_name, "up")
+    
+    @ttl_cache(seconds=5)
+    def get_interfaces_by_name(self) -> Dict[str, NetworkInterface]:
+        """اینترفیس‌های عمومی به صورت dict بر اساس نام (برای بررسی وجود با O(1))"""
+        return {iface.name: iface for iface in self.get_interfaces()}
+    
+    def _prefix_to_netmask(self, prefix_len: int) -> str:
+        """تبدیل prefix length به netmask"""
+        return _PREFIX_TO_NETMASK[prefix_len]
     
+    @ttl_cache(seconds=5)
     def _get_dns_servers(self) -> List[str]:
         """دریافت DNS servers"""
-        dns_servers = []
         try:
-            if os.path.exists("/etc/resolv.conf"):
-                with open("/etc/resolv.conf", "r") as f:
-                    for line in f:
-                        if line.strip().startswith("nameserver"):
-                            dns_server = line.strip().split()[1]
-                            dns_servers.append(dns_server)
+            with open("/etc/resolv.conf", "rb") as f:
+                return [server.decode() for server in _NAMESERVER_RE.findall(f.read())]
         except Exception:
-            pass
-        return dns_servers
+            return []
     
     def _is_dhcp_enabled(self, interface_name: str) -> bool:
         """بررسی فعال بودن DHCP برای یک اینترفیس"""
@@ -176,17 +587,78 @@ class NetworkManager:
             return self._check_dhcp_interfaces(interface_name)
         return False
     
+    def _list_netplan_files(self) -> List[os.DirEntry]:
+        """لیست فایل‌های yaml در /etc/netplan (با یک بار خواندن دایرکتوری)"""
+        try:
+            with os.scandir("/etc/netplan") as it:
+                return [entry for entry in it if entry.name.endswith(".yaml") and entry.is_file()]
+        except FileNotFoundError:
+            return []
+    
+    def _netplan_signature(self) -> Tuple[int, int]:
+        """تعداد فایل‌های netplan و بیشترین mtime آن‌ها (برای تشخیص تغییر بدون خواندن محتوا)"""
+        entries = self._list_netplan_files()
+        return len(entries), max((entry.stat().st_mtime_ns for entry in entries), default=0)
+    
+    def netplan_generate_needed(self) -> Optional[Tuple[int, int]]:
+        """اگر فایل‌های netplan از آخرین generate موفق تغییر کرده‌اند، وضعیت فعلی را برمی‌گرداند، وگرنه None"""
+        try:
+            signature = self._netplan_signature()
+        except OSError:
+            # در صورت خطا در stat، احتیاطاً generate اجرا شود
+            return _UNKNOWN_NETPLAN_SIGNATURE
+        return None if signature == self._last_generate_signature else signature
+    
+    def mark_netplan_generated(self, signature: Tuple[int, int]):
+        """ثبت وضعیت فایل‌های netplan بعد از یک generate موفق"""
+        if signature != _UNKNOWN_NETPLAN_SIGNATURE:
+            self._last_generate_signature = signature
+    
+    @serialized
+    def netplan_generate(self) -> bool:
+        """اجرای netplan generate اگر فایل‌ها از آخرین generate موفق تغییر کرده‌اند (True یعنی اجرا شد)"""
+        # با config lock اجرا می‌شود تا فایل‌ها در حین خواندن توسط netplan تغییر نکنند
+        signature = self.netplan_generate_needed()
+        if signature is None:
+            return False
+        subprocess.run([self._tool("netplan"), "generate"], capture_output=True, check=True, timeout=60)
+        self.mark_netplan_generated(signature)
+        return True
+    
+    def _queue_netplan_generate(self):
+        """زمان‌بندی netplan generate در پس‌زمینه؛ اگر یکی در صف است، همان کافی است"""
+        with self._apply_lock:
+            if self._generate_queued:
+                return
+            self._generate_queued = True
+        self._generate_executor.submit(self._run_queued_netplan_generate)
+    
+    def _run_queued_netplan_generate(self):
+        """اجرای netplan generate زمان‌بندی شده و گزارش نتیجه آن"""
+        with self._apply_lock:
+            self._generate_queued = False
+        try:
+            if self.netplan_generate():
+                print("Generated netplan configuration")
+        except subprocess.CalledProcessError as e:
+            print(f"Warning: netplan generate failed with exit code {e.returncode}: {e.stderr.strip()}")
+        except (subprocess.SubprocessError, FileNotFoundError) as e:
+            print(f"Warning: Could not run netplan generate: {e}")
+    
+    def _netplan_file_mentions(self, config_file: str, interface_name: str) -> bool:
+        """بررسی سریع وجود نام اینترفیس در فایل، بدون parse کردن YAML"""
+        with open(config_file, "rb") as f:
+            return interface_name.encode() in f.read()
+    
     def _check_dhcp_netplan(self, interface_name: str) -> bool:
         """بررسی DHCP در netplan"""
         try:
-            netplan_dir = Path("/etc/netplan")
-            for config_file in netplan_dir.glob("*.yaml"):
-                with open(config_file, "r") as f:
-                    config = yaml.safe_load(f)
-                    if config and "network" in config:
-                        ethernets = config["network"].get("ethernets", {})
-                        if interface_name in ethernets:
-                            return ethernets[interface_name].get("dhcp4", False)
+            for entry in self._list_netplan_files():
+                config = self._load_netplan_config(entry.path)
+                if config and "network" in config:
+                    ethernets = config["network"].get("ethernets", {})
+                    if interface_name in ethernets:
+                        return ethernets[interface_name].get("dhcp4", False)
         except Exception:
             pass
         return False
@@ -196,64 +668,134 @@ class NetworkManager:
         try:
             with open("/etc/network/interfaces", "r") as f:
                 content = f.read()
-                pattern = rf"iface\s+{interface_name}\s+inet\s+dhcp"
-                return bool(re.search(pattern, content))
+                return bool(_dhcp_pattern(interface_name).search(content))
         except Exception:
             pass
         return False
     
+    @serialized
     def configure_interface(self, interface_name: str, config: NetworkConfig) -> bool:
         """پیکربندی یک اینترفیس شبکه"""
-        if self.config_type == "netplan":
-            return self._configure_netplan(interface_name, config)
-        elif self.config_type == "interfaces":
-            return self._configure_interfaces(interface_name, config)
+        try:
+            if self.config_type == "netplan":
+                return self._configure_netplan(interface_name, config)
+            elif self.config_type == "interfaces":
+                return self._configure_interfaces(interface_name, config)
+            else:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"نوع پیکربندی {self.config_type} پشتیبانی نمی‌شود"
+                )
+        finally:
+            # اطلاعات کش شده اینترفیس‌ها و DNS بعد از این تغییر معتبر نیستند
+            self._cache.invalidate()
+    
+    def _build_netplan_config(self, interface_name: str, config: NetworkConfig) -> dict:
+        """ساخت dict پیکربندی netplan برای یک اینترفیس"""
+        netplan_config = {
+            "network": {
+                "version": 2,
+                "ethernets": {
+                    interface_name: {}
+                }
+            }
+        }
+        
+        if config.is_dhcp:
+            netplan_config["network"]["ethernets"][interface_name]["dhcp4"] = True
         else:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"نوع پیکربندی {self.config_type} پشتیبانی نمی‌شود"
-            )
+            # محاسبه CIDR از IP و netmask
+            cidr = self._calculate_cidr(config.ip_address, config.netmask)
+            netplan_config["network"]["ethernets"][interface_name]["addresses"] = [cidr]
+            
+            # استفاده از routes جدید به جای gateway4 deprecated
+            if config.gateway:
+                netplan_config["network"]["ethernets"][interface_name]["routes"] = [
+                    {
+                        "to": "default",
+                        "via": config.gateway
+                    }
+                ]
+            
+            if config.dns_servers:
+                netplan_config["network"]["ethernets"][interface_name]["nameservers"] = {
+                    "addresses": config.dns_servers
+                }
+        
+        return netplan_config
+    
+    def _emit_netplan_yaml(self, netplan_config: dict) -> str:
+        """نوشتن YAML پیکربندی ساخته شده توسط _build_netplan_config بدون emitter عمومی yaml"""
+        network = netplan_config.get("network", {})
+        ethernets = network.get("ethernets", {})
+        iface = next(iter(ethernets.values()), None) if len(ethernets) == 1 else None
+        known_shape = (
+            set(network) == {"version", "ethernets"}
+            and isinstance(network["version"], int)
+            and isinstance(iface, dict)
+            and set(iface) <= {"dhcp4", "addresses", "routes", "nameservers"}
+            and set(iface.get("nameservers", {})) <= {"addresses"}
+            and all(set(route) == {"to", "via"} for route in iface.get("routes", []))
+        )
+        if not known_shape:
+            # برای ساختارهای دیگر از yaml.dump استفاده کن
+            return yaml.dump(netplan_config, Dumper=_YamlDumper, default_flow_style=False)
+        
+        # رشته‌های JSON همان scalar های double-quoted در YAML هستند
+        quote = json.dumps
+        lines = ["network:", "  ethernets:", f"    {quote(next(iter(ethernets)))}:"]
+        # کلیدها به ترتیب الفبا، مشابه خروجی yaml.dump
+        if "addresses" in iface:
+            lines.append("      addresses:")
+            lines.extend(f"      - {quote(address)}" for address in iface["addresses"])
+        if "dhcp4" in iface:
+            lines.append(f"      dhcp4: {quote(bool(iface['dhcp4']))}")
+        if "nameservers" in iface:
+            lines.append("      nameservers:")
+            lines.append("        addresses:")
+            lines.extend(f"        - {quote(server)}" for server in iface["nameservers"]["addresses"])
+        if "routes" in iface:
+            lines.append("      routes:")
+            for route in iface["routes"]:
+                lines.append(f"      - to: {quote(route['to'])}")
+                lines.append(f"        via: {quote(route['via'])}")
+        lines.append(f"  version: {network['version']}")
+        return "\n".join(lines) + "\n"
+    
+    def _netplan_config_unchanged(self, interface_name: str, netplan_config: dict) -> bool:
+        """بررسی اینکه آیا تنها فایل netplan این اینترفیس دقیقاً همین پیکربندی را دارد"""
+        try:
+            matches = []
+            for entry in self._list_netplan_files():
+                if not self._netplan_file_mentions(entry.path, interface_name):
+                    continue
+                existing = self._load_netplan_config(entry.path)
+                if existing and interface_name in (existing.get("network") or {}).get("ethernets", {}):
+                    matches.append(existing)
+            return len(matches) == 1 and matches[0] == netplan_config
+        except Exception:
+            return False
     
     def _configure_netplan(self, interface_name: str, config: NetworkConfig) -> bool:
         """پیکربندی اینترفیس با netplan"""
         try:
-            # ابتدا فایل‌های قبلی این اینترفیس را پاک کن
-            self._cleanup_netplan_files(interface_name)
+            netplan_config = self._build_netplan_config(interface_name, config)
             
-            netplan_config = {
-                "network": {
-                    "version": 2,
-                    "ethernets": {
-                        interface_name: {}
-                    }
-                }
-            }
+            # اگر تنظیمات فعلی دقیقاً همین است و آخرین اعمال آن موفق بوده، نوشتن فایل و apply لازم نیست
+            # (اگر apply قبلی شکست خورده باشد، درخواست تکراری باید دوباره اعمال شود)
+            if (self._applied_netplan.get(interface_name) == netplan_config
+                    and self._netplan_config_unchanged(interface_name, netplan_config)):
+                print(f"Netplan configuration for {interface_name} is unchanged")
+                return True
+            self._applied_netplan.pop(interface_name, None)
             
-            if config.is_dhcp:
-                netplan_config["network"]["ethernets"][interface_name]["dhcp4"] = True
-            else:
-                # محاسبه CIDR از IP و netmask
-                cidr = self._calculate_cidr(config.ip_address, config.netmask)
-                netplan_config["network"]["ethernets"][interface_name]["addresses"] = [cidr]
-                
-                # استفاده از routes جدید به جای gateway4 deprecated
-                if config.gateway:
-                    netplan_config["network"]["ethernets"][interface_name]["routes"] = [
-                        {
-                            "to": "default",
-                            "via": config.gateway
-                        }
-                    ]
-                
-                if config.dns_servers:
-                    netplan_config["network"]["ethernets"][interface_name]["nameservers"] = {
-                        "addresses": config.dns_servers
-                    }
+            # ابتدا فایل‌های قبلی این اینترفیس را پاک کن
+            self._cleanup_netplan_files(interface_name)
             
             # نوشتن فایل پیکربندی جدید
             config_file = f"/etc/netplan/01-{interface_name}.yaml"
             with open(config_file, "w") as f:
-                yaml.dump(netplan_config, f, default_flow_style=False)
+                f.write(self._emit_netplan_yaml(netplan_config))
             
             # تنظیم مجوزهای صحیح برای فایل netplan
             try:
@@ -270,36 +812,43 @@ class NetworkManager:
                 # در container، systemd ممکن است کار نکند، پس فقط generate کنیم
                 if self.is_container:
                     # در container فقط فایل‌ها را تولید کن، سیستم را restart نکن
-                    subprocess.run(["netplan", "generate"], check=True)
-                    print(f"Generated netplan configuration for {interface_name}")
+                    # generate در پس‌زمینه اجرا می‌شود تا پاسخ درخواست منتظر آن نماند
+                    if not _SKIP_CONTAINER_GENERATE:
+                        self._queue_netplan_generate()
+                        print(f"Queued netplan generate for {interface_name}")
                     # سپس IP را مستقیماً با ip command اعمال کن
                     self._apply_ip_directly(interface_name, config)
+                    self._mark_netplan_applied(interface_name, config)
                 else:
-                    # در host system معمولی از apply استفاده کن
-                    subprocess.run(["netplan", "apply"], check=True)
+                    # در host system معمولی از apply استفاده کن (با تاخیر کوتاه و ادغام درخواست‌ها)
+                    if self._find_tool("netplan") is None:
+                        raise FileNotFoundError("netplan")
+                    self.schedule_netplan_apply(interface_name, config)
             except (subprocess.CalledProcessError, FileNotFoundError) as e:
                 # اگر netplan وجود نداشت یا کار نکرد، IP را مستقیماً اعمال کن
                 print(f"Warning: Could not apply netplan configuration for {interface_name}: {e}")
                 print(f"Applying IP configuration directly...")
                 self._apply_ip_directly(interface_name, config)
+                self._mark_netplan_applied(interface_name, config)
             return True
             
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"خطا در پیکربندی netplan: {str(e)}")
     
+    @serialized
     def _cleanup_netplan_files(self, interface_name: str):
         """پاک کردن فایل‌های netplan قبلی مربوط به یک اینترفیس"""
         try:
-            netplan_dir = Path("/etc/netplan")
-            if not netplan_dir.exists():
-                return
-            
             # جستجو برای فایل‌هایی که این اینترفیس را تعریف می‌کنند
-            for config_file in netplan_dir.glob("*.yaml"):
+            for entry in self._list_netplan_files():
+                config_file = entry.path
                 try:
-                    with open(config_file, "r") as f:
-                        config = yaml.safe_load(f)
-                        
+                    # فایل‌هایی که نام اینترفیس در آن‌ها نیامده، parse نمی‌شوند
+                    if not self._netplan_file_mentions(config_file, interface_name):
+                        continue
+                    
+                    config = self._load_netplan_config(config_file)
+                    
                     if config and "network" in config:
                         ethernets = config["network"].get("ethernets", {})
                         
@@ -307,20 +856,23 @@ class NetworkManager:
                         if interface_name in ethernets:
                             # اگر فایل فقط این اینترفیس را دارد، کل فایل را پاک کن
                             if len(ethernets) == 1:
-                                config_file.unlink()
+                                os.unlink(config_file)
                                 print(f"Removed netplan file: {config_file}")
                             else:
                                 # اگر فایل چندین اینترفیس دارد، فقط این اینترفیس را حذف کن
+                                # (روی یک کپی، چون نتیجه کش شده مشترک است)
+                                config = copy.deepcopy(config)
+                                ethernets = config["network"]["ethernets"]
                                 del ethernets[interface_name]
                                 
                                 # اگر بعد از حذف، هیچ اینترفیسی نماند، فایل را پاک کن
                                 if not ethernets:
-                                    config_file.unlink()
+                                    os.unlink(config_file)
                                     print(f"Removed empty netplan file: {config_file}")
                                 else:
                                     # فایل به‌روزرسانی شده را ذخیره کن
                                     with open(config_file, "w") as f:
-                                        yaml.dump(config, f, default_flow_style=False)
+                                        yaml.dump(config, f, Dumper=_YamlDumper, default_flow_style=False)
                                     print(f"Updated netplan file: {config_file}")
                 
                 except Exception as e:
@@ -331,13 +883,22 @@ class NetworkManager:
         except Exception as e:
             print(f"Warning: Could not cleanup netplan files: {e}")
             # در صورت خطا در cleanup، ادامه بده
+        finally:
+            # وضعیت DHCP اینترفیس‌ها از فایل‌های netplan خوانده می‌شود
+            self._cache.invalidate()
+    
+    def _load_netplan_config(self, config_file: str, st: Optional[os.stat_result] = None):
+        """خواندن فایل netplan از کش (نتیجه مشترک است و نباید تغییر داده شود)"""
+        if st is None:
+            st = os.stat(config_file)
+        return _load_yaml_file(str(config_file), st.st_mtime_ns, st.st_size)
     
     def _validate_netplan_config(self, config_file: str) -> bool:
         """اعتبارسنجی فایل netplan"""
         try:
             # بررسی syntax با netplan
             result = subprocess.run(
-                ["netplan", "info", config_file], 
+                [self._tool("netplan"), "info", config_file], 
                 capture_output=True, 
                 text=True, 
                 check=False
@@ -346,27 +907,82 @@ class NetworkManager:
         except Exception:
             # اگر netplan info در دسترس نیست، فقط YAML را بررسی کن
             try:
-                with open(config_file, 'r') as f:
-                    yaml.safe_load(f)
+                self._load_netplan_config(config_file)
                 return True
             except Exception:
                 return False
     
+    def _validate_all_netplan(self, config_files: List[str]) -> Dict[str, bool]:
+        """اعتبارسنجی همه فایل‌های netplan با یک بار اجرای netplan generate"""
+        if not config_files:
+            return {}
+        
+        try:
+            # netplan کل دایرکتوری را با هم parse می‌کند؛ در یک root موقت اجرا شود تا خروجی‌ای روی سیستم نوشته نشود
+            with tempfile.TemporaryDirectory(prefix="netplan-check-") as root_dir:
+                check_dir = os.path.join(root_dir, "etc", "netplan")
+                os.makedirs(check_dir)
+                for config_file in config_files:
+                    shutil.copy(config_file, check_dir)
+                
+                result = subprocess.run(
+                    [self._tool("netplan"), "generate", "--root-dir", root_dir],
+                    capture_output=True,
+                    text=True,
+                    check=False,
+                    timeout=60
+                )
+        except (FileNotFoundError, subprocess.TimeoutExpired):
+            # اگر netplan در دسترس نیست، هر فایل جداگانه (به صورت موازی) بررسی شود
+            with ThreadPoolExecutor(max_workers=_VALIDATE_WORKERS) as executor:
+                return dict(zip(config_files, executor.map(self._validate_netplan_config, config_files)))
+        
+        if result.returncode == 0:
+            return {f: True for f in config_files}
+        
+        # نسبت دادن خطاها به فایل‌هایی که در گزارش netplan نام برده شده‌اند
+        report = result.stderr + result.stdout
+        failed = {
+            f for f in config_files
+            if os.path.join(check_dir, os.path.basename(f)) in report
+        }
+        if not failed:
+            # خطا به فایل خاصی نسبت داده نشد، پس هیچ فایلی معتبر در نظر گرفته نمی‌شود
+            return {f: False for f in config_files}
+        return {f: f not in failed for f in config_files}
+    
+    def _run_ip_batch(self, commands: List[str]) -> Set[int]:
+        """اجرای چند دستور ip با یک پردازه (ip -batch) و برگرداندن شماره خطوط ناموفق"""
+        # با -force اجرا بعد از اولین خطا متوقف نمی‌شود
+        result = subprocess.run([self._tool("ip"), "-force", "-batch", "-"], input="\n".join(commands) + "\n",
+                                capture_output=True, text=True, check=False, close_fds=False)
+        return {int(line) for line in _IP_BATCH_FAILED_RE.findall(result.stderr)}
+    
     def _apply_ip_directly(self, interface_name: str, config: NetworkConfig):
         """اعمال مستقیم IP configuration با ip command"""
+        # مقادیر داخل اسکریپت ip -batch نوشته می‌شوند؛ هر مقدار باید یک توکن معتبر باشد
+        if not self._is_public_network_interface(interface_name):
+            raise ValueError(f"Invalid interface name: {interface_name!r}")
+        if not config.is_dhcp:
+            _check_ip_token(config.ip_address)
+            if config.gateway:
+                _check_ip_token(config.gateway)
+        
         try:
             print(f"Applying IP configuration directly to {interface_name}")
             
-            # ابتدا اینترفیس را فعال کن
-            subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=False)
+            # ابتدا اینترفیس را فعال کن و IP قبلی را پاک کن (همه دستورات ip با یک پردازه اجرا می‌شوند)
+            commands = [
+                f"link set dev {interface_name} up",
+                f"addr flush dev {interface_name}"
+            ]
             
             if config.is_dhcp:
                 # برای DHCP، سعی کن dhclient استفاده کنی
+                self._run_ip_batch(commands)
                 try:
-                    # ابتدا IP استاتیک قبلی را پاک کن
-                    subprocess.run(["ip", "addr", "flush", "dev", interface_name], check=False)
                     # شروع DHCP
-                    subprocess.run(["dhclient", interface_name], check=True)
+                    subprocess.run([self._tool("dhclient"), interface_name], check=True)
                     print(f"DHCP started for {interface_name}")
                 except (subprocess.CalledProcessError, FileNotFoundError):
                     # اگر dhclient نبود، حداقل اینترفیس را فعال کن
@@ -375,23 +991,26 @@ class NetworkManager:
                 # برای IP استاتیک
                 cidr = self._calculate_cidr(config.ip_address, config.netmask)
                 
-                # پاک کردن IP قبلی
-                subprocess.run(["ip", "addr", "flush", "dev", interface_name], check=False)
-                
                 # اضافه کردن IP جدید
-                subprocess.run(["ip", "addr", "add", cidr, "dev", interface_name], check=True)
+                commands.append(f"addr add {cidr} dev {interface_name}")
+                addr_line = len(commands)
+                
+                # اضافه کردن gateway (حذف route قبلی و اضافه کردن route جدید)
+                if config.gateway:
+                    commands.append(f"route del default dev {interface_name}")
+                    commands.append(f"route add default via {config.gateway} dev {interface_name}")
+                route_line = len(commands)
+                
+                failed = self._run_ip_batch(commands)
+                if addr_line in failed:
+                    raise subprocess.CalledProcessError(2, ["ip", "addr", "add", cidr, "dev", interface_name])
                 print(f"Added IP {cidr} to {interface_name}")
                 
-                # اضافه کردن gateway
                 if config.gateway:
-                    try:
-                        # حذف route قبلی
-                        subprocess.run(["ip", "route", "del", "default", "dev", interface_name], check=False)
-                        # اضافه کردن route جدید
-                        subprocess.run(["ip", "route", "add", "default", "via", config.gateway, "dev", interface_name], check=True)
+                    if route_line in failed:
+                        print(f"Warning: Could not set gateway {config.gateway} for {interface_name}")
+                    else:
                         print(f"Added gateway {config.gateway} for {interface_name}")
-                    except subprocess.CalledProcessError as e:
-                        print(f"Warning: Could not set gateway: {e}")
                 
                 # به‌روزرسانی DNS
                 if config.dns_servers:
@@ -405,6 +1024,7 @@ class NetworkManager:
             print(f"Error applying IP directly: {e}")
             raise
     
+    @serialized
     def _update_dns_servers(self, dns_servers: List[str]):
         """به‌روزرسانی DNS servers در /etc/resolv.conf"""
         try:
@@ -432,15 +1052,40 @@ class NetworkManager:
     
     def _calculate_cidr(self, ip_address: str, netmask: str) -> str:
         """تبدیل IP address و netmask به فرمت CIDR"""
-        try:
-            # تبدیل netmask به باینری و شمارش بیت‌های 1
-            netmask_int = struct.unpack("!I", socket.inet_aton(netmask))[0]
-            prefix_length = bin(netmask_int).count('1')
+        # برای netmask نامعتبر، فرض می‌کنیم /24
+        return f"{ip_address}/{_NETMASK_TO_PREFIX.get(netmask, 24)}"
+    
+    def _remove_interfaces_stanzas(self, content: str, interface_name: str) -> str:
+        """حذف خطوط auto/allow-* و بلوک iface یک اینترفیس از محتوای /etc/network/interfaces"""
+        new_lines = []
+        skipping = False
+        
+        for line in content.splitlines(keepends=True):
+            tokens = line.split()
+            keyword = tokens[0] if tokens else ""
+            
+            if keyword in _INTERFACES_STANZA_KEYWORDS or keyword.startswith("allow-"):
+                # شروع بلوک جدید، پایان بلوک قبلی
+                skipping = False
+                
+                if keyword == "iface":
+                    if len(tokens) > 1 and tokens[1] == interface_name:
+                        skipping = True
+                        continue
+                elif keyword == "auto" or keyword.startswith("allow-"):
+                    if interface_name in tokens[1:]:
+                        # در خطوطی مثل "auto eth0 eth1" فقط نام این اینترفیس حذف می‌شود
+                        others = [name for name in tokens[1:] if name != interface_name]
+                        if others:
+                            new_lines.append(" ".join([keyword] + others) + "\n")
+                        continue
+            elif skipping:
+                # خطوط تنظیمات بلوک iface این اینترفیس
+                continue
             
-            return f"{ip_address}/{prefix_length}"
-        except:
-            # در صورت خطا، فرض می‌کنیم /24
-            return f"{ip_address}/24"
+            new_lines.append(line)
+        
+        return "".join(new_lines)
     
     def _configure_interfaces(self, interface_name: str, config: NetworkConfig) -> bool:
         """پیکربندی اینترفیس با /etc/network/interfaces"""
@@ -454,8 +1099,7 @@ class NetworkManager:
                 content = ""
             
             # حذف پیکربندی قبلی این اینترفیس
-            pattern = rf"auto\s+{interface_name}.*?(?=auto\s+\w+|iface\s+\w+|\Z)"
-            content = re.sub(pattern, "", content, flags=re.DOTALL)
+            content = self._remove_interfaces_stanzas(content, interface_name)
             
             # اضافه کردن پیکربندی جدید
             new_config = f"\nauto {interface_name}\n"
@@ -481,13 +1125,13 @@ class NetworkManager:
             
             # راه‌اندازی مجدد اینترفیس برای interfaces
             try:
-                subprocess.run(["ifdown", interface_name], check=False)
-                subprocess.run(["ifup", interface_name], check=True)
+                subprocess.run([self._tool("ifdown"), interface_name], check=False)
+                subprocess.run([self._tool("ifup"), interface_name], check=True)
             except (subprocess.CalledProcessError, FileNotFoundError):
                 # اگر ifup/ifdown کار نکرد، از ip command استفاده کن
                 try:
-                    subprocess.run(["ip", "link", "set", "dev", interface_name, "down"], check=False)
-                    subprocess.run(["ip", "link", "set", "dev", interface_name, "up"], check=True)
+                    subprocess.run([self._tool("ip"), "link", "set", "dev", interface_name, "down"], check=False)
+                    subprocess.run([self._tool("ip"), "link", "set", "dev", interface_name, "up"], check=True)
                 except subprocess.CalledProcessError:
                     print(f"Warning: Could not restart interface {interface_name}")
             
@@ -502,16 +1146,35 @@ class NetworkManager:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"خطا در پیکربندی interfaces: {str(e)}")
     
+    @ttl_cache(seconds=5)
     def get_hostname(self) -> str:
         """دریافت hostname فعلی سیستم"""
+        # تا زمانی که /etc/hostname تغییر نکرده، نتیجه قبلی معتبر است
+        try:
+            mtime = os.stat('/etc/hostname').st_mtime_ns
+        except OSError:
+            return self._query_hostname()
+        
+        cached = self._hostname_cache
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
+        hostname = self._query_hostname()
+        self._hostname_cache = (mtime, hostname)
+        return hostname
+    
+    def _query_hostname(self) -> str:
+        """خواندن hostname از hostnamectl، hostname یا فایل /etc/hostname"""
         try:
             # ابتدا hostnamectl را امتحان کن
-            result = subprocess.run(['hostnamectl', 'hostname'], capture_output=True, text=True, check=True)
+            result = subprocess.run([self._tool("hostnamectl"), 'hostname'], capture_output=True, text=True, check=True,
+                                    close_fds=False)
             return result.stdout.strip()
         except (subprocess.CalledProcessError, FileNotFoundError):
             try:
                 # اگر hostnamectl وجود نداشت، از hostname استفاده کن
-                result = subprocess.run(['hostname'], capture_output=True, text=True, check=True)
+                result = subprocess.run([self._tool("hostname")], capture_output=True, text=True, check=True,
+                                        close_fds=False)
                 return result.stdout.strip()
             except subprocess.CalledProcessError:
                 try:
@@ -524,12 +1187,13 @@ class NetworkManager:
                 except Exception:
                     return "unknown"
     
+    @serialized
     def set_hostname(self, new_hostname: str) -> bool:
         """تنظیم hostname جدید برای سیستم"""
         try:
             # ابتدا hostnamectl را امتحان کن
             try:
-                subprocess.run(['hostnamectl', 'set-hostname', new_hostname], check=True)
+                subprocess.run([self._tool("hostnamectl"), 'set-hostname', new_hostname], check=True)
                 hostname_set_success = True
             except (subprocess.CalledProcessError, FileNotFoundError):
                 # اگر hostnamectl وجود نداشت، فقط فایل‌ها را به‌روزرسانی کن
@@ -555,6 +1219,9 @@ class NetworkManager:
             raise HTTPException(status_code=500, detail=f"خطا در تنظیم hostname: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"خطا در به‌روزرسانی فایل‌های hostname: {str(e)}")
+        finally:
+            self._hostname_cache = None
+            self._cache.invalidate("get_hostname")
     
     def _update_hosts_file(self, new_hostname: str):
         """به‌روزرسانی فایل /etc/hosts با hostname جدید"""
@@ -564,27 +1231,28 @@ class NetworkManager:
                 with open(hosts_file, 'r') as f:
                     content = f.read()
                 
-                # حذف ورودی‌های قبلی hostname
-                lines = content.splitlines()
+                # یک بار پیمایش خطوط: جایگزینی خط 127.0.1.1 و بررسی وجود localhost
                 new_lines = []
                 hostname_updated = False
+                localhost_exists = False
                 
-                for line in lines:
-                    if line.strip().startswith('127.0.1.1'):
-                        # به‌روزرسانی خط 127.0.1.1
-                        new_lines.append(f"127.0.1.1\t{new_hostname}")
-                        hostname_updated = True
-                    elif not (line.strip().startswith('127.0.0.1') and 'localhost' in line):
-                        # نگه‌داشتن سایر خطوط به جز localhost
-                        if not any(old_name in line for old_name in ['127.0.1.1']):
-                            new_lines.append(line)
+                for line in content.splitlines():
+                    stripped = line.lstrip()
+                    if stripped.startswith('127.0.1.1'):
+                        # به‌روزرسانی اولین خط 127.0.1.1 و حذف خطوط تکراری بعدی
+                        if not hostname_updated:
+                            new_lines.append(f"127.0.1.1\t{new_hostname}")
+                            hostname_updated = True
+                        continue
+                    if stripped.startswith('127.0.0.1') and 'localhost' in line:
+                        localhost_exists = True
+                    new_lines.append(line)
                 
                 # اگر خط 127.0.1.1 وجود نداشت، اضافه کن
                 if not hostname_updated:
                     new_lines.append(f"127.0.1.1\t{new_hostname}")
                 
                 # اطمینان از وجود localhost
-                localhost_exists = any('127.0.0.1' in line and 'localhost' in line for line in new_lines)
                 if not localhost_exists:
                     new_lines.insert(0, "127.0.0.1\tlocalhost")
                 
@@ -1,4 +1,7 @@
+from contextlib import asynccontextmanager
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 import uvicorn
 import sys
 import os
@@ -6,13 +9,32 @@ import os
 # Add the current directory to the path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from core.network_manager import NetworkManager
+
 # Import routers
 from api.system_routes import router as system_router
 from api.hostname_routes import router as hostname_router
 from api.interface_routes import router as interface_router
 from api.network_routes import router as network_router
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # یک instance مشترک از NetworkManager برای تمام routerها (و کش مشترک آن)
+    app.state.network_manager = NetworkManager()
+    
+    # ASYNCIO_DEBUG=1 کدهای blocking داخل handlerهای async را (بیشتر از 10ms) گزارش می‌کند
+    if os.environ.get("ASYNCIO_DEBUG"):
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)
+        loop.slow_callback_duration = 0.01
+    
+    yield
+    
+    await asyncio.to_thread(app.state.network_manager.close)
+
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     title="Linux Network Configuration API", 
     version="1.0.0",
     description="API برای مدیریت تنظیمات شبکه در سیستم‌های لینوکس",
@@ -47,4 +69,13 @@ app.include_router(interface_router)
 app.include_router(network_router)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # هر worker یک پروسه مستقل با NetworkManager، کش، lock ها و صف netplan apply مخصوص خودش است؛
+    # پیش‌فرض یک worker است تا تغییرات تنظیمات و apply ها پشت سر هم انجام شوند
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.environ.get("API_WORKERS", 1)),
+        loop="uvloop",
+        http="httptools"
+    )
@@ -1,7 +1,29 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, IPvAnyAddress, TypeAdapter, ValidationError, field_validator, model_validator
 from typing import List, Optional
+import ipaddress
+
+# جدول تبدیل prefix length و netmask (فقط 33 حالت دارد)
+_PREFIX_TO_NETMASK = {p: str(ipaddress.IPv4Network(f"0.0.0.0/{p}").netmask) for p in range(33)}
+_NETMASK_TO_PREFIX = {netmask: p for p, netmask in _PREFIX_TO_NETMASK.items()}
+
+_ip_address_adapter = TypeAdapter(IPvAnyAddress)
+
+def _validate_ip(value: str, allow_empty: bool = False) -> str:
+    """بررسی اینکه مقدار یک آدرس IP معتبر است (مقدار به صورت رشته باقی می‌ماند)"""
+    if allow_empty and value == "":
+        return value
+    if any(c.isspace() for c in value):
+        raise ValueError("IP address must not contain whitespace")
+    try:
+        _ip_address_adapter.validate_python(value)
+    except ValidationError:
+        raise ValueError(f"{value!r} is not a valid IP address")
+    return value
 
 class NetworkInterface(BaseModel):
+    # خروجی سرور است و با model_construct ساخته می‌شود
+    model_config = ConfigDict(extra='ignore', validate_assignment=False)
+    
     name: str
     ip_address: Optional[str] = None
     netmask: Optional[str] = None
@@ -16,6 +38,40 @@ class NetworkConfig(BaseModel):
     gateway: Optional[str] = None
     dns_servers: Optional[List[str]] = None
     is_dhcp: bool = False
+    
+    # این مقادیر در دستورات ip، فایل‌های netplan و resolv.conf نوشته می‌شوند
+    # در حالت DHCP ممکن است ip_address و netmask خالی فرستاده شوند
+    @field_validator("ip_address")
+    @classmethod
+    def _check_address(cls, value: str) -> str:
+        return _validate_ip(value, allow_empty=True)
+    
+    @field_validator("netmask")
+    @classmethod
+    def _check_netmask(cls, value: str) -> str:
+        """netmask پیوسته IPv4 (مثل 255.255.255.0) یا prefix length (0 تا 32) که به netmask تبدیل می‌شود"""
+        if value == "" or value in _NETMASK_TO_PREFIX:
+            return value
+        # isascii لازم است چون isdigit ارقام یونیکد را هم قبول می‌کند
+        if value.isascii() and value.isdigit() and int(value) in _PREFIX_TO_NETMASK:
+            return _PREFIX_TO_NETMASK[int(value)]
+        raise ValueError(f"{value!r} is not a valid IPv4 netmask or prefix length (0-32)")
+    
+    @model_validator(mode="after")
+    def _check_static_address(self) -> "NetworkConfig":
+        if not self.is_dhcp and (not self.ip_address or not self.netmask):
+            raise ValueError("ip_address and netmask are required when is_dhcp is false")
+        return self
+    
+    @field_validator("gateway")
+    @classmethod
+    def _check_gateway(cls, value: Optional[str]) -> Optional[str]:
+        return None if value is None else _validate_ip(value)
+    
+    @field_validator("dns_servers")
+    @classmethod
+    def _check_dns_servers(cls, value: Optional[List[str]]) -> Optional[List[str]]:
+        return None if value is None else [_validate_ip(server) for server in value]
 
 class HostnameConfig(BaseModel):
     hostname: str